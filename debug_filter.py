@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-import sys, os
+import asyncio, sys, os
 sys.path.append('src')
 
 from src.app.filter.variation_theory_filter import VariationTheoryFilter
@@ -37,7 +37,7 @@ print(prompt)
 print()
 
 # Get raw LLM response
-response = vt_filter.client.run(prompt, system="You are an English-speaking assistant. Respond only in English.", max_tokens=400, retries=1)
+response = vt_filter.client.run(prompt, max_tokens=400, retries=1)
 
 print("=== RAW LLM RESPONSE ===")
 print(response)
@@ -46,4 +46,12 @@ print()
 # Parse the response
 result = vt_filter._parse_json_response(response)
 print("=== PARSED RESULT ===")
-print(result)
\ No newline at end of file
+print(result)
+print()
+
+# Run the full pipeline the way make_demos does (concurrent combined-filter requests)
+results = asyncio.run(vt_filter.apply_three_stage_filter_many([
+    {"original": original, "counterfactual": counterfactual, "pattern_info": pattern_info, "target_label": target_label}
+]))
+print("=== FILTER RESULT ===")
+print(results[0])
@@ -4,8 +4,37 @@ Simple viewer for generated counterfactual sentences
 """
 import argparse
 import json
+import mmap
+import re
+import sys
 from pathlib import Path
 
+# Run as a plain script (python scripts/view_cf.py): make the repo root importable
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from src.app.utils.io import resolve_latest
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    def _loads(buf):
+        return json.loads(bytes(buf))
+
+# One "original" key per candidate object
+_CANDIDATE_KEY_RE = re.compile(rb'"original"\s*:')
+
+def _read_mapped(file_path, fn):
+    """Apply fn to the file's bytes through a read-only mmap (no read copy)"""
+    with open(file_path, "rb") as f:
+        if f.seek(0, 2) == 0:  # mmap cannot map an empty file
+            return fn(memoryview(b""))
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            return fn(view)
+
+def count_candidates(file_path):
+    """Number of candidates in a file, counted without parsing it"""
+    return _read_mapped(resolve_latest(file_path), lambda buf: sum(1 for _ in _CANDIDATE_KEY_RE.finditer(buf)))
+
 def view_candidates(file_path, limit=10, min_score=0.0):
     """View counterfactual candidates with filtering options"""
     
@@ -13,8 +42,7 @@ def view_candidates(file_path, limit=10, min_score=0.0):
         print(f"❌ File not found: {file_path}")
         return
     
-    with open(file_path) as f:
-        candidates = json.load(f)
+    candidates = _read_mapped(resolve_latest(file_path), _loads)
     
     # Filter by score if specified
     if min_score > 0:
@@ -69,7 +97,7 @@ def main():
         demo_path = Path("reports/demos")
         if demo_path.exists():
             for file in sorted(demo_path.glob("all_candidates_*.json")):
-                size = len(json.loads(file.read_text())) if file.exists() else 0
+                size = count_candidates(file) if file.exists() else 0
                 print(f"   {file.name} ({size} candidates)")
         else:
             print("   No demo files found")
@@ -1,47 +1,61 @@
 import json
-from pathlib import Path
-from jinja2 import Template
-from ..llm.ollama import OllamaClient
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from ..llm.factory import get_client
+from ..llm.grammars import label_grammar
+from ..utils.jinja_env import ENV
+from ..utils.json_fast import extract_json_strict, json_text
 
 def _render(path: str, **kwargs):
-    return Template(Path(path).read_text()).render(**kwargs)
+    return ENV.get_template(path).render(**kwargs)
 
 def _strict_json(s: str):
-    # Handle markdown code blocks
-    if "```json" in s:
-        start = s.find("```json") + 7
-        end = s.find("```", start)
-        if end != -1:
-            s = s[start:end].strip()
-    
-    i = s.find("{"); j = s.rfind("}")
-    if i == -1 or j == -1 or j <= i: raise ValueError("No JSON in LLM output")
-    
-    json_str = s[i:j+1]
     try:
-        return json.loads(json_str)
+        return extract_json_strict(s)
     except json.JSONDecodeError as e:
-        # Try to fix common escape sequence issues
-        import re
-        # Fix common problematic escape sequences
-        fixed_json = json_str.replace('\\n', '\\\\n').replace('\\t', '\\\\t').replace('\\r', '\\\\r')
-        fixed_json = re.sub(r'(?<!\\)\\(?!["\\/bfnrt])', r'\\\\', fixed_json)
+        # Rare path: non-strict stdlib parse accepts raw control characters inside strings
         try:
-            return json.loads(fixed_json)
+            return json.loads(json_text(s), strict=False)
         except json.JSONDecodeError:
             raise ValueError(f"Could not parse JSON: {e}")
 
+class _AnnotationFailed(Exception):
+    """Raised out of the memoized call so lru_cache does not keep the fallback label"""
+
 def annotate_label(cfg, task_cfg, text: str, labels):
-    client = OllamaClient(cfg["model_ann"], temperature=0.2)
-    tpl = Template(Path("prompts/annotation/annotator.txt").read_text())
-    prompt = tpl.render(text=text, labels=", ".join(labels))
-    out = client.run(prompt, system=None, max_tokens=cfg["ann_max_new"], retries=1)
+    # Memoized per (backend, model, text, labels): repeated counterfactuals across rows cost one call
+    runner = cfg.get("runner", "ollama")
+    try:
+        result = _annotate_label_memo(runner, cfg.get(f"{runner}_host"), cfg["model_ann"], cfg["ann_max_new"], text, tuple(labels))
+    except _AnnotationFailed:
+        # Fallback: return first label if JSON parsing completely fails (not cached, so a later call retries)
+        return {"label": labels[0]}
+    # Copy: the cached dict is shared by every caller
+    return dict(result)
+
+@lru_cache(maxsize=4096)
+def _annotate_label_memo(runner, host, model: str, ann_max_new: int, text: str, labels: tuple):
+    client = get_client({"runner": runner, f"{runner}_host": host}, model, temperature=0.2)
+    prompt = _render("prompts/annotation/annotator.txt", text=text, labels=", ".join(labels))
+    grammar = label_grammar(labels)
+    if client.supports_grammar:
+        # Output is constrained to {"label": <one of labels>}, so it parses first time
+        out = client.run(prompt, system=None, max_tokens=max(16, ann_max_new), retries=1, grammar=grammar)
+        return extract_json_strict(out)
+    out = client.run(prompt, system=None, max_tokens=ann_max_new, retries=1)
     try:
         return _strict_json(out)
     except Exception:
         try:
-            out = client.run(prompt, system=None, max_tokens=max(16, cfg["ann_max_new"]), retries=0)
+            out = client.run(prompt, system=None, max_tokens=max(16, ann_max_new), retries=0)
             return _strict_json(out)
-        except Exception:
-            # Fallback: return first label if JSON parsing completely fails
-            return {"label": labels[0]}
+        except Exception as e:
+            raise _AnnotationFailed(text) from e
+
+def annotate_label_batch(cfg, task_cfg, texts: list[str], labels):
+    """annotate_label for every text, with up to cfg["ollama_parallel"] requests in flight; results keep input order"""
+    if len(texts) <= 1:
+        return [annotate_label(cfg, task_cfg, text, labels) for text in texts]
+    workers = min(len(texts), max(1, int(cfg.get("ollama_parallel", 8))))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda text: annotate_label(cfg, task_cfg, text, labels), texts))
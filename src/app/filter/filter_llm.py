@@ -1,36 +1,29 @@
-from jinja2 import Template
-from pathlib import Path
 import json
-from ..llm.ollama import OllamaClient
+from ..llm.factory import get_client
+from ..utils.jinja_env import ENV
+from ..utils.json_fast import extract_json_strict, json_text, sanitize_json_escapes
 
 def filter_llm(cfg, orig_text: str, cf_text: str, target_label: str):
-    tpl = Template(Path("prompts/filtering/filter.txt").read_text())
+    tpl = ENV.get_template("prompts/filtering/filter.txt")
     prompt = tpl.render(orig=orig_text, cf=cf_text, target=target_label)
-    client = OllamaClient(cfg["model_ann"], temperature=0.2)
+    client = get_client(cfg, cfg["model_ann"], temperature=0.2)
     out = client.run(prompt, system=None, max_tokens=cfg.get("filter_max_new", 64))
     
-    # Handle markdown code blocks
-    if "```json" in out:
-        start = out.find("```json") + 7
-        end = out.find("```", start)
-        if end != -1:
-            out = out[start:end].strip()
-    
-    i, j = out.find("{"), out.rfind("}")
-    if i == -1 or j == -1 or j <= i:
-        return {"pass_all": False, "score": 0.0, "reasons": {"parse":"fail"}}
-    
-    json_str = out[i:j+1]
     try:
-        data = json.loads(json_str)
+        data = extract_json_strict(out)
     except json.JSONDecodeError:
-        # Try to fix common escape sequence issues
-        import re
-        fixed_json = json_str.replace('\\n', '\\\\n').replace('\\t', '\\\\t').replace('\\r', '\\\\r')
-        fixed_json = re.sub(r'(?<!\\)\\(?!["\\/bfnrt])', r'\\\\', fixed_json)
+        json_str = json_text(out)
+        # Escape stray backslashes (one pass); non-strict mode accepts raw control characters
         try:
-            data = json.loads(fixed_json)
+            data = json.loads(sanitize_json_escapes(json_str), strict=False)
         except json.JSONDecodeError:
             return {"pass_all": False, "score": 0.0, "reasons": {"parse":"fail"}}
-    overall = 0.25*float(data.get("minimality", 0.0)) + 0.25*float(data.get("fluency", 0.0)) + 0.30*float(data.get("label_determinism", 0.0)) + 0.20*float(data.get("faithfulness", 0.0))
+    except ValueError:
+        return {"pass_all": False, "score": 0.0, "reasons": {"parse":"fail"}}
+    # Components clamped to [0,1] so an out-of-range answer cannot inflate the weighted score
+    minimality, fluency, label_determinism, faithfulness = (
+        min(max(float(data.get(field, 0.0)), 0.0), 1.0)
+        for field in ("minimality", "fluency", "label_determinism", "faithfulness")
+    )
+    overall = 0.25*minimality + 0.25*fluency + 0.30*label_determinism + 0.20*faithfulness
     return {"pass_all": overall >= float(cfg.get("filter_threshold", 0.70)), "score": overall, "reasons": data}
@@ -7,20 +7,94 @@ Implements the complete filtering system from the research paper:
 - C3: LLM Discriminator Filter (Label Flip Rate - LFR, Soft Label Flip Rate - SLFR)
 """
 
-import json
+import asyncio
+import difflib
+from collections import Counter
 import re
-from pathlib import Path
-from jinja2 import Template
-from ..llm.ollama import OllamaClient
+import numpy as np
+import requests
+from ..llm.factory import make_client
+from ..llm.grammars import (COMBINED_FILTER_GRAMMAR, COMBINED_NO_QUALITY_GRAMMAR,
+                            COMBINED_FILTER_BATCH_GRAMMAR, COMBINED_NO_QUALITY_BATCH_GRAMMAR)
+from ..utils.cache import DiskCache, hash_key
+from ..utils.jinja_env import ENV
+from ..utils.json_fast import extract_json, extract_json_strict
+from ..utils.log import get_logger
+
+log = get_logger()
+
+FILTER_SYSTEM_PROMPT = "You are an English-speaking assistant. Respond only in English."
+
+# Bump when the combined-filter prompts or score parsing change, so cached results are not reused
+CACHE_VERSION = 3
+
+# Literal C1 indicators: prompt leakage (matched case-insensitively at the start) and
+# JSON remnants (matched anywhere). Shared by the scalar scan regex and the batch path.
+_PROMPT_INDICATORS = ("original:", "counterfactual:", "label:", "target:",
+                      "instructions:", "example:", "generate", "json:")
+_JSON_INDICATORS = ("{", "}", "[", "]", "```", "json")
+
+
+def _alternation(literals):
+    return "|".join(re.escape(literal) for literal in literals)
+
+
+# C1 pattern rules compiled into one alternation: a single pass over the text checks every
+# indicator at once, and finditer reports which rules fired (by group name)
+_C1_SCAN_RE = re.compile(
+    rf"(?P<leak>\A(?i:{_alternation(_PROMPT_INDICATORS)}))"
+    r"|(?P<ellipsis>\.\.\Z)"
+    rf"|(?P<json>{_alternation(_JSON_INDICATORS)})"
+    r"|(?P<cjk>[\u4e00-\u9fff\u3400-\u4dbf])"
+)
+# CJK check on its own, for the batch path (the other rules run as numpy string kernels there)
+_CJK_RE = re.compile(r"[\u4e00-\u9fff\u3400-\u4dbf]")
+_C1_REASONS = {
+    "ellipsis": "Incomplete text (ellipsis)",
+    "leak": "Prompt leakage",
+    "json": "JSON formatting remnants",
+    "cjk": "Non-English characters detected",
+}
+
+# Placeholders rendered into the combined-prompt skeleton in place of the per-candidate texts
+_ORIGINAL_SLOT = "\x00ORIGINAL\x00"
+_COUNTERFACTUAL_SLOT = "\x00COUNTERFACTUAL\x00"
+_SLOT_RE = re.compile(f"({_ORIGINAL_SLOT}|{_COUNTERFACTUAL_SLOT})")
+
+_QUALITY_FIELDS = ("minimality", "fluency", "label_determinism", "faithfulness")
+# Overall-score weights for (pkr, lfr, slfr, *quality fields)
+_SCORE_WEIGHTS = np.array([0.25, 0.35, 0.25] + [0.15 / len(_QUALITY_FIELDS)] * len(_QUALITY_FIELDS))
+
+# Text fallbacks for scores when an LLM response is not valid JSON
+_SCORE_RE = re.compile(r'(\d+\.?\d*)')
+_PKR_RE = re.compile(r'pkr[_\s]*score[:\s]*(\d+\.?\d*)', re.IGNORECASE)
+_LFR_RE = re.compile(r'lfr[_\s]*score[:\s]*(\d+\.?\d*)', re.IGNORECASE)
+_SLFR_RE = re.compile(r'slfr[_\s]*score[:\s]*(\d+\.?\d*)', re.IGNORECASE)
+_C3_LFR_RE = re.compile(r'LFR[:\s]*(\d+\.?\d*)', re.IGNORECASE)
+_C3_SLFR_RE = re.compile(r'SLFR[:\s]*(\d+\.?\d*)', re.IGNORECASE)
+
+
+def _excessive_repetition(text):
+    """More than half of a 4+ word text is one repeated word (sign of generation issues)"""
+    words = text.split()
+    if len(words) <= 3:
+        return False
+    # Counter counts in C
+    return Counter(words).most_common(1)[0][1] > len(words) // 2
 
 
 class VariationTheoryFilter:
     """Three-stage filtering pipeline matching the research paper"""
     
     def __init__(self, cfg):
-        self.client = OllamaClient(cfg["model_ann"], temperature=0.0)
+        # Backend picked by cfg["runner"]; clients share one keep-alive session per worker.
+        # The system prompt is set once here so every filter call shares the same cached prefix
+        self.client = make_client(cfg, cfg["model_ann"], temperature=0.0, system=FILTER_SYSTEM_PROMPT)
         self.cfg = cfg
         
+        # Persistent cache of combined-filter results for identical inputs across runs
+        self.cache = DiskCache(cfg.get("filter_cache_dir", "cache/vt_filter")) if cfg.get("filter_cache", True) else None
+        
         # Load prompt templates
         self._load_templates()
     
@@ -28,7 +102,12 @@ class VariationTheoryFilter:
         """Load Jinja2 templates for filtering stages"""
         # Only load combined filter template - individual filters are no longer used
         # Individual filters were: pattern_consistency_filter.txt, label_flip_discriminator.txt, filter.txt
-        self.combined_template = Template(Path("prompts/filtering/combined_filter.txt").read_text())
+        self.combined_template = ENV.get_template("prompts/filtering/combined_filter.txt")
+        # Without a pattern rule the quality fields are not requested (fewer output tokens)
+        self.combined_no_quality_template = ENV.get_template("prompts/filtering/combined_no_quality.txt")
+        self.combined_batch_template = ENV.get_template("prompts/filtering/combined_filter_batch.txt")
+        # (pattern_rule, target_label) -> combined prompt split around the candidate slots
+        self._combined_skeletons = {}
     
     def apply_three_stage_filter(self, original, counterfactual, pattern_info, target_label):
         """Apply C1 + optimized combined C2+C3 filtering pipeline"""
@@ -36,63 +115,210 @@ class VariationTheoryFilter:
         # Stage C1: Regex Heuristic Filter
         c1_result = self._stage_c1_heuristic_filter(counterfactual)
         if not c1_result["pass"]:
-            return {
-                "pass_all": False,
-                "stage_failed": "C1",
-                "reason": c1_result["reason"],
-                "pkr": 0.0,
-                "lfr": 0.0,
-                "slfr": 0.0,
-                "score": 0.0,
-                "details": {"c1": c1_result}
-            }
+            return self._c1_failure_result(c1_result)
+        
+        # Early exit: obvious C2/C3 failures need no LLM call
+        prefilter_result = self._cheap_prefilter(original, counterfactual)
+        if prefilter_result:
+            return self._prefilter_failure_result(c1_result, prefilter_result)
         
         # Combined C2+C3: Use single LLM call for all metrics (OPTIMIZATION)
         combined_result = self._combined_filter(original, counterfactual, pattern_info, target_label)
         
-        pkr_score = combined_result["pkr"]
-        lfr_score = combined_result["lfr"]
-        slfr_score = combined_result["slfr"]
+        return self._finalize_result(c1_result, combined_result)
+    
+    def quick_prescreen(self, original, counterfactual):
+        """True if the candidate survives C1 and the similarity prefilter (no LLM call)
+
+        Callers run this before paying for label annotation; the full filter repeats these
+        checks, so prescreened candidates get the same verdicts as before.
+        """
+        if not self._stage_c1_heuristic_filter(counterfactual)["pass"]:
+            return False
+        return self._cheap_prefilter(original, counterfactual) is None
+    
+    def apply_three_stage_filter_batch(self, items):
+        """Apply C1 + batched combined C2+C3 filtering to many candidates
+        
+        Each item is a dict with keys: original, counterfactual, pattern_info, target_label.
+        C1 runs locally on every item; the survivors are scored by the LLM in chunks of
+        cfg["filter_batch_size"] items per call. Results are returned in input order.
+        """
+        results = [None] * len(items)
+        
+        # Stage C1 + pre-filter: cheap, no LLM
+        passing = self._local_stages(items, results)
+        
+        # Combined C2+C3: one LLM call per chunk of distinct candidates (OPTIMIZATION)
+        groups = self._group_duplicates(items, passing)
+        batch_size = max(1, int(self.cfg.get("filter_batch_size", 16)))
+        combined_results = []
+        for start in range(0, len(groups), batch_size):
+            chunk = groups[start:start + batch_size]
+            combined_results.extend(self._combined_filter_batch([items[group[0][0]] for group in chunk]))
+        self._fill_results(results, groups, combined_results)
+        
+        return results
+    
+    async def apply_three_stage_filter_batch_async(self, items):
+        """apply_three_stage_filter_batch in a worker thread, so concurrent rows keep running"""
+        return await asyncio.to_thread(self.apply_three_stage_filter_batch, items)
+    
+    def judge_fn(self):
+        """The async judge make_demos passes to the row pipeline
+        
+        cfg["filter_batching"] (default on) scores each row's candidates with one batched
+        combined-filter call; off, every candidate gets its own concurrent request.
+        """
+        if self.cfg.get("filter_batching", True):
+            return self.apply_three_stage_filter_batch_async
+        return self.apply_three_stage_filter_many
+    
+    async def apply_three_stage_filter_many(self, items):
+        """Apply C1 + combined C2+C3 filtering with concurrent LLM requests
+        
+        Same item format as apply_three_stage_filter_batch. Each distinct C1 survivor gets its
+        own combined-filter request; up to cfg["ollama_parallel"] of them are in flight at once
+        so Ollama can serve them across its OLLAMA_NUM_PARALLEL slots.
+        """
+        results = [None] * len(items)
+        semaphore = asyncio.Semaphore(max(1, int(self.cfg.get("ollama_parallel", 8))))
+        
+        async def run_one(item):
+            async with semaphore:
+                return await self._combined_filter_async(
+                    item["original"], item["counterfactual"], item.get("pattern_info"), item["target_label"]
+                )
+        
+        groups = self._group_duplicates(items, self._local_stages(items, results))
+        combined_results = await asyncio.gather(*[run_one(items[group[0][0]]) for group in groups])
+        self._fill_results(results, groups, combined_results)
+        
+        return results
+    
+    def _local_stages(self, items, results):
+        """C1 + cheap pre-filter for every item; fills in results for rejects and returns survivors as (idx, c1_result)"""
+        passing = []
+        c1_results = self._c1_results([item["counterfactual"] for item in items])
+        for idx, (item, c1_result) in enumerate(zip(items, c1_results)):
+            if not c1_result["pass"]:
+                results[idx] = self._c1_failure_result(c1_result)
+                continue
+            prefilter_result = self._cheap_prefilter(item["original"], item["counterfactual"])
+            if prefilter_result:
+                results[idx] = self._prefilter_failure_result(c1_result, prefilter_result)
+                continue
+            passing.append((idx, c1_result))
+        return passing
+    
+    def _group_duplicates(self, items, passing):
+        """Group survivors with identical (original, counterfactual, pattern_rule, target_label)
+        so each distinct evaluation is requested once and broadcast back"""
+        groups = {}
+        for idx, c1_result in passing:
+            item = items[idx]
+            key = (item["original"], item["counterfactual"], self._pattern_rule(item.get("pattern_info")), item["target_label"])
+            groups.setdefault(key, []).append((idx, c1_result))
+        return list(groups.values())
+    
+    def _fill_results(self, results, groups, combined_results):
+        """Finalize every grouped survivor in one vectorized pass and write it to results"""
+        members = [(idx, c1_result, combined_result)
+                   for group, combined_result in zip(groups, combined_results)
+                   for idx, c1_result in group]
+        finalized = self._finalize_results([(c1_result, combined_result) for _, c1_result, combined_result in members])
+        for (idx, _, _), result in zip(members, finalized):
+            results[idx] = result
+    
+    def _c1_failure_result(self, c1_result):
+        """Build the result for a candidate rejected by C1"""
+        return {
+            "pass_all": False,
+            "stage_failed": "C1",
+            "reason": c1_result["reason"],
+            "pkr": 0.0,
+            "lfr": 0.0,
+            "slfr": 0.0,
+            "score": 0.0,
+            "details": {"c1": c1_result}
+        }
+    
+    def _prefilter_failure_result(self, c1_result, prefilter_result):
+        """Build the result for a candidate rejected by the cheap pre-filter"""
+        return {
+            "pass_all": False,
+            "stage_failed": prefilter_result["stage_failed"],
+            "reason": prefilter_result["reason"],
+            "pkr": 0.0,
+            "lfr": 0.0,
+            "slfr": 0.0,
+            "score": 0.0,
+            "details": {"c1": c1_result, "prefilter": prefilter_result}
+        }
+    
+    def _finalize_result(self, c1_result, combined_result):
+        """Apply thresholds and weighting to combined C2+C3 scores"""
+        return self._finalize_results([(c1_result, combined_result)])[0]
+    
+    def _finalize_results(self, pairs):
+        """Apply thresholds and weighting to many (c1_result, combined_result) pairs at once
+        
+        Scores are stacked into an (N, 7) array (pkr, lfr, slfr, then the four quality
+        fields) so clamping, weighting and threshold checks run as whole-array operations.
+        Quality that was not requested (no pattern rule) counts as the 0.5 default the parser
+        has always used for missing fields, so every candidate is scored on the same scale.
+        """
+        if not pairs:
+            return []
+        
+        scores = np.array([
+            [combined["pkr"], combined["lfr"], combined["slfr"]]
+            + [combined["quality"].get(field, 0.5) for field in _QUALITY_FIELDS]
+            for _, combined in pairs
+        ], dtype=np.float64)
+        np.clip(scores, 0.0, 1.0, out=scores)
         
         # Pass thresholds from config
         pkr_threshold = self.cfg.get("pkr_threshold", 0.7)
         lfr_threshold = self.cfg.get("lfr_threshold", 0.8)
         slfr_threshold = self.cfg.get("slfr_threshold", 0.8)
         
-        # Determine which stage failed (if any)
-        stage_failed = "None"
-        reason = combined_result.get("reason", "")
-        
-        if pkr_score < pkr_threshold:
-            stage_failed = "C2"
-            reason = f"Pattern violation (PKR: {pkr_score:.3f} < {pkr_threshold})"
-        elif lfr_score < lfr_threshold or slfr_score < slfr_threshold:
-            stage_failed = "C3"
-            reason = f"Label flip issues (LFR: {lfr_score:.3f}, SLFR: {slfr_score:.3f})"
-        
-        pass_all = (pkr_score >= pkr_threshold and 
-                   lfr_score >= lfr_threshold and 
-                   slfr_score >= slfr_threshold)
+        pkr_ok = scores[:, 0] >= pkr_threshold
+        flip_ok = (scores[:, 1] >= lfr_threshold) & (scores[:, 2] >= slfr_threshold)
+        pass_all = pkr_ok & flip_ok
         
         # Calculate overall score (weighted combination)
-        # PKR: 25%, LFR: 35%, SLFR: 25%, Quality: 15%
-        quality_scores = combined_result["quality"]
-        quality_avg = sum(quality_scores.values()) / len(quality_scores) if quality_scores else 0.0
-        overall_score = (pkr_score * 0.25 + lfr_score * 0.35 + slfr_score * 0.25 + quality_avg * 0.15)
+        # PKR: 25%, LFR: 35%, SLFR: 25%, Quality: 15% (quality average = 4 x 3.75%)
+        overall = scores @ _SCORE_WEIGHTS
         
-        return {
-            "pass_all": pass_all,
-            "stage_failed": stage_failed,
-            "reason": reason,
-            "pkr": pkr_score,
-            "lfr": lfr_score, 
-            "slfr": slfr_score,
-            "score": overall_score,
-            "details": {
-                "c1": c1_result,
-                "combined": combined_result
-            }
-        }
+        results = []
+        for n, (c1_result, combined_result) in enumerate(pairs):
+            pkr_score, lfr_score, slfr_score = (float(v) for v in scores[n, :3])
+            
+            # Determine which stage failed (if any)
+            stage_failed = "None"
+            reason = combined_result.get("reason", "")
+            if not pkr_ok[n]:
+                stage_failed = "C2"
+                reason = f"Pattern violation (PKR: {pkr_score:.3f} < {pkr_threshold})"
+            elif not flip_ok[n]:
+                stage_failed = "C3"
+                reason = f"Label flip issues (LFR: {lfr_score:.3f}, SLFR: {slfr_score:.3f})"
+            
+            results.append({
+                "pass_all": bool(pass_all[n]),
+                "stage_failed": stage_failed,
+                "reason": reason,
+                "pkr": pkr_score,
+                "lfr": lfr_score,
+                "slfr": slfr_score,
+                "score": float(overall[n]),
+                "details": {
+                    "c1": c1_result,
+                    "combined": combined_result
+                }
+            })
+        return results
     
     def _stage_c1_heuristic_filter(self, text):
         """C1: Enhanced heuristic filter for malformed generations"""
@@ -105,42 +331,102 @@ class VariationTheoryFilter:
         if text.count('"') % 2 != 0:
             return {"pass": False, "reason": "Unmatched quotes"}
         
+        # Pattern rules (ellipsis, prompt leakage, JSON remnants, CJK) in a single scan
+        fired = {m.lastgroup for m in _C1_SCAN_RE.finditer(text)}
+        
         # Check for incomplete/cutoff text
-        if text.endswith("...") or text.endswith(".."):
-            return {"pass": False, "reason": "Incomplete text (ellipsis)"}
+        if "ellipsis" in fired:
+            return {"pass": False, "reason": _C1_REASONS["ellipsis"]}
         
         # Check for prompt leakage
-        prompt_indicators = [
-            "original:", "counterfactual:", "label:", "target:", 
-            "instructions:", "example:", "generate", "json:"
-        ]
-        text_lower = text.lower()
-        if any(text_lower.startswith(indicator) for indicator in prompt_indicators):
-            return {"pass": False, "reason": "Prompt leakage"}
+        if "leak" in fired:
+            return {"pass": False, "reason": _C1_REASONS["leak"]}
         
         # Check for repeated patterns (sign of generation issues)
-        words = text.split()
-        if len(words) > 3:
-            # Check for excessive repetition
-            word_counts = {}
-            for word in words:
-                word_counts[word] = word_counts.get(word, 0) + 1
-            
-            max_repetition = max(word_counts.values()) if word_counts else 0
-            if max_repetition > len(words) // 2:
-                return {"pass": False, "reason": "Excessive word repetition"}
-        
-        # Check for malformed JSON remnants
-        json_indicators = ["{", "}", "[", "]", "```", "json"]
-        if any(indicator in text for indicator in json_indicators):
-            return {"pass": False, "reason": "JSON formatting remnants"}
+        if _excessive_repetition(text):
+            return {"pass": False, "reason": "Excessive word repetition"}
         
-        # Check for non-English characters (basic)
-        if re.search(r'[\u4e00-\u9fff\u3400-\u4dbf]', text):  # Chinese characters
-            return {"pass": False, "reason": "Non-English characters detected"}
+        # Check for malformed JSON remnants / non-English characters (basic)
+        for rule in ("json", "cjk"):
+            if rule in fired:
+                return {"pass": False, "reason": _C1_REASONS[rule]}
         
         return {"pass": True, "reason": "Passed heuristic checks"}
     
+    def _stage_c1_heuristic_filter_batch(self, texts):
+        """C1 over many texts at once; returns a boolean pass mask"""
+        return np.array([reason is None for reason in self._c1_reasons_batch(texts)], dtype=bool)
+    
+    def _c1_reasons_batch(self, texts):
+        """C1 failure reason per text (None if it passes), same verdicts as the scalar filter
+        
+        Length, quote, ellipsis, leakage and JSON checks run as numpy string kernels over the
+        whole array. Only texts that pass the first four get the Python checks, in the scalar
+        order: word repetition, then the JSON hit, then the CJK regex.
+        """
+        reasons = [None] * len(texts)
+        if not texts:
+            return reasons
+        
+        arr = np.array(texts, dtype=str)
+        lower = np.char.lower(arr)
+        
+        stages = [
+            ("Text too short", np.char.str_len(np.char.strip(arr)) < 5),
+            ("Unmatched quotes", np.char.count(arr, '"') % 2 != 0),
+            (_C1_REASONS["ellipsis"], np.char.endswith(arr, "..")),
+            (_C1_REASONS["leak"], np.logical_or.reduce([np.char.startswith(lower, i) for i in _PROMPT_INDICATORS])),
+        ]
+        json_hit = np.logical_or.reduce([np.char.find(arr, i) >= 0 for i in _JSON_INDICATORS])
+        
+        undecided = np.ones(len(texts), dtype=bool)
+        for reason, failed in stages:
+            for i in np.flatnonzero(undecided & failed):
+                reasons[i] = reason
+            undecided &= ~failed
+        
+        for i in np.flatnonzero(undecided):
+            text = texts[i]
+            if _excessive_repetition(text):
+                reasons[i] = "Excessive word repetition"
+            elif json_hit[i]:
+                reasons[i] = _C1_REASONS["json"]
+            elif _CJK_RE.search(text):
+                reasons[i] = _C1_REASONS["cjk"]
+        
+        return reasons
+    
+    def _c1_results(self, texts):
+        """Per-text C1 result dicts from one batch pass (no scalar re-run for failures)"""
+        return [
+            {"pass": True, "reason": "Passed heuristic checks"} if reason is None else {"pass": False, "reason": reason}
+            for reason in self._c1_reasons_batch(texts)
+        ]
+    
+    def _cheap_prefilter(self, original, counterfactual):
+        """Pre-decide C2/C3 failures from text similarity alone (no LLM)
+        
+        Returns None when the LLM filter has to decide, otherwise the failing stage and reason.
+        """
+        ratio = difflib.SequenceMatcher(None, original, counterfactual).ratio()
+        
+        # Near-identical text cannot flip the label (LFR = 0)
+        if ratio > self.cfg.get("prefilter_max_ratio", 0.98):
+            return {"stage_failed": "C3", "reason": f"Counterfactual unchanged from original (similarity: {ratio:.3f})",
+                    "ratio": ratio}
+        
+        # Rewritten from scratch: fails minimality. Token overlap guards against
+        # reorderings, which score low on character similarity but keep the words.
+        if ratio < self.cfg.get("prefilter_min_ratio", 0.2):
+            orig_tokens = set(original.lower().split())
+            cf_tokens = set(counterfactual.lower().split())
+            jaccard = len(orig_tokens & cf_tokens) / max(1, len(orig_tokens | cf_tokens))
+            if jaccard < self.cfg.get("prefilter_min_jaccard", 0.1):
+                return {"stage_failed": "C2", "reason": f"Counterfactual not a minimal edit (similarity: {ratio:.3f}, overlap: {jaccard:.3f})",
+                        "ratio": ratio, "jaccard": jaccard}
+        
+        return None
+    
     def _stage_c2_pattern_filter(self, text, pattern_info):
         """C2: Neuro-symbolic pattern consistency filter (PKR)"""
         
@@ -159,7 +445,7 @@ class VariationTheoryFilter:
         )
         
         try:
-            response = self.client.run(prompt, system="You are an English-speaking assistant. Respond only in English.", max_tokens=200, retries=1)
+            response = self.client.run(prompt, max_tokens=200, retries=1)
             
             # Parse JSON response
             result = self._parse_json_response(response)
@@ -170,7 +456,7 @@ class VariationTheoryFilter:
                 return {"pkr": pkr_score, "reason": reason}
             else:
                 # Fallback: extract score from text
-                score_match = re.search(r'(\d+\.?\d*)', response)
+                score_match = _SCORE_RE.search(response)
                 if score_match:
                     pkr_score = float(score_match.group(1))
                     if pkr_score > 1.0:  # Handle percentage format
@@ -194,7 +480,7 @@ class VariationTheoryFilter:
         )
         
         try:
-            response = self.client.run(prompt, system="You are an English-speaking assistant. Respond only in English.", max_tokens=200, retries=1)
+            response = self.client.run(prompt, max_tokens=200, retries=1)
             
             # Parse JSON response
             result = self._parse_json_response(response)
@@ -214,8 +500,8 @@ class VariationTheoryFilter:
                 }
             else:
                 # Fallback: parse from text
-                lfr_match = re.search(r'LFR[:\s]*(\d+\.?\d*)', response, re.IGNORECASE)
-                slfr_match = re.search(r'SLFR[:\s]*(\d+\.?\d*)', response, re.IGNORECASE)
+                lfr_match = _C3_LFR_RE.search(response)
+                slfr_match = _C3_SLFR_RE.search(response)
                 
                 lfr_score = float(lfr_match.group(1)) if lfr_match else 0.0
                 slfr_score = float(slfr_match.group(1)) if slfr_match else 0.0
@@ -254,7 +540,7 @@ class VariationTheoryFilter:
         )
         
         try:
-            response = self.client.run(prompt, system="You are an English-speaking assistant. Respond only in English.", max_tokens=200, retries=1)
+            response = self.client.run(prompt, max_tokens=200, retries=1)
             
             # Parse JSON response
             result = self._parse_json_response(response)
@@ -292,124 +578,267 @@ class VariationTheoryFilter:
     def _combined_filter(self, original, counterfactual, pattern_info, target_label):
         """Combined C2+C3 filter - evaluates all metrics in single LLM call (OPTIMIZATION)"""
         
-        pattern_rule = ""
-        if pattern_info and pattern_info.get("strategy") == "pattern_guided":
-            pattern_rule = pattern_info.get("pattern_rule", "")
+        key = self._cache_key(original, counterfactual, pattern_info, target_label)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
         
-        # Render combined filter prompt
-        prompt = self.combined_template.render(
-            original=original,
-            counterfactual=counterfactual,
-            pattern_rule=pattern_rule,
-            target_label=target_label
-        )
+        prompt = self._combined_prompt(original, counterfactual, pattern_info, target_label)
+        grammar = COMBINED_FILTER_GRAMMAR if self._pattern_rule(pattern_info) else COMBINED_NO_QUALITY_GRAMMAR
         
         try:
-            response = self.client.run(prompt, system="You are an English-speaking assistant. Respond only in English.", max_tokens=400, retries=1)
-            
-            # Parse JSON response
-            result = self._parse_json_response(response)
-            if result:
-                # Extract all scores
-                pkr_score = float(result.get("pkr_score", 0.5))
-                lfr_score = float(result.get("lfr_score", 0.0))
-                slfr_score = float(result.get("slfr_score", 0.0))
-                minimality = float(result.get("minimality", 0.5))
-                fluency = float(result.get("fluency", 0.5))
-                label_determinism = float(result.get("label_determinism", 0.5))
-                faithfulness = float(result.get("faithfulness", 0.5))
-                reason = result.get("overall_reason", "Combined evaluation completed")
-                
-                # Clamp all scores to [0,1]
-                pkr_score = min(max(pkr_score, 0.0), 1.0)
-                lfr_score = min(max(lfr_score, 0.0), 1.0)
-                slfr_score = min(max(slfr_score, 0.0), 1.0)
-                minimality = min(max(minimality, 0.0), 1.0)
-                fluency = min(max(fluency, 0.0), 1.0)
-                label_determinism = min(max(label_determinism, 0.0), 1.0)
-                faithfulness = min(max(faithfulness, 0.0), 1.0)
-                
-                return {
-                    "pkr": pkr_score,
-                    "lfr": lfr_score,
-                    "slfr": slfr_score,
-                    "quality": {
-                        "minimality": minimality,
-                        "fluency": fluency,
-                        "label_determinism": label_determinism,
-                        "faithfulness": faithfulness
-                    },
-                    "reason": reason
-                }
-            else:
-                # Fallback: parse individual scores from text
-                pkr_match = re.search(r'pkr[_\s]*score[:\s]*(\d+\.?\d*)', response, re.IGNORECASE)
-                lfr_match = re.search(r'lfr[_\s]*score[:\s]*(\d+\.?\d*)', response, re.IGNORECASE)
-                slfr_match = re.search(r'slfr[_\s]*score[:\s]*(\d+\.?\d*)', response, re.IGNORECASE)
-                
-                pkr_score = float(pkr_match.group(1)) if pkr_match else 0.5
-                lfr_score = float(lfr_match.group(1)) if lfr_match else 0.0
-                slfr_score = float(slfr_match.group(1)) if slfr_match else 0.0
-                
-                # Handle percentage format
-                if pkr_score > 1.0:
-                    pkr_score = pkr_score / 100.0
-                if lfr_score > 1.0:
-                    lfr_score = lfr_score / 100.0
-                if slfr_score > 1.0:
-                    slfr_score = slfr_score / 100.0
-                
-                # Clamp scores to [0,1]
-                pkr_score = min(max(pkr_score, 0.0), 1.0)
-                lfr_score = min(max(lfr_score, 0.0), 1.0)
-                slfr_score = min(max(slfr_score, 0.0), 1.0)
-                
-                return {
-                    "pkr": pkr_score,
-                    "lfr": lfr_score,
-                    "slfr": slfr_score,
-                    "quality": {
-                        "minimality": 0.5,
-                        "fluency": 0.5,
-                        "label_determinism": 0.5,
-                        "faithfulness": 0.5
-                    },
-                    "reason": "Combined evaluation parsed from text"
-                }
-                
+            response = self.client.run(prompt, max_tokens=400, retries=1, grammar=grammar)
+            result = self._parse_combined_response(response, bool(self._pattern_rule(pattern_info)))
         except Exception as e:
-            return {
-                "pkr": 0.5,
-                "lfr": 0.0,
-                "slfr": 0.0,
-                "quality": {
-                    "minimality": 0.5,
-                    "fluency": 0.5,
-                    "label_determinism": 0.5,
-                    "faithfulness": 0.5
-                },
-                "reason": f"Error in combined evaluation: {str(e)[:50]}"
-            }
-
-    def _parse_json_response(self, response):
-        """Parse JSON from LLM response with fallback handling"""
+            return self._combined_error_result(e)
+        
+        self._cache_set(key, result)
+        return result
+    
+    async def _combined_filter_async(self, original, counterfactual, pattern_info, target_label):
+        """Async variant of _combined_filter so many candidates can be in flight at once"""
+        
+        key = self._cache_key(original, counterfactual, pattern_info, target_label)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+        
+        prompt = self._combined_prompt(original, counterfactual, pattern_info, target_label)
+        grammar = COMBINED_FILTER_GRAMMAR if self._pattern_rule(pattern_info) else COMBINED_NO_QUALITY_GRAMMAR
+        
         try:
-            # Handle markdown code blocks
-            if "```json" in response:
-                start = response.find("```json") + 7
-                end = response.find("```", start)
-                if end != -1:
-                    response = response[start:end].strip()
+            response = await self.client.arun(prompt, max_tokens=400, retries=1, grammar=grammar)
+            result = self._parse_combined_response(response, bool(self._pattern_rule(pattern_info)))
+        except Exception as e:
+            return self._combined_error_result(e)
+        
+        self._cache_set(key, result)
+        return result
+    
+    def _cache_key(self, original, counterfactual, pattern_info, target_label):
+        """Cache key for a combined-filter evaluation"""
+        return hash_key(CACHE_VERSION, self.cfg["model_ann"], original, counterfactual,
+                        self._pattern_rule(pattern_info), target_label)
+    
+    def _cache_get(self, key):
+        return self.cache.get(key) if self.cache is not None else None
+    
+    def _cache_set(self, key, result):
+        if self.cache is not None:
+            self.cache.set(key, result)
+    
+    def _combined_prompt(self, original, counterfactual, pattern_info, target_label):
+        """Build the combined C2+C3 filter prompt
+        
+        The template is rendered once per (pattern_rule, target_label) with placeholder
+        slots; each call only splices the two candidate texts into that skeleton.
+        """
+        pattern_rule = self._pattern_rule(pattern_info)
+        skeleton = self._combined_skeletons.get((pattern_rule, target_label))
+        if skeleton is None:
+            template = self.combined_template if pattern_rule else self.combined_no_quality_template
+            rendered = template.render(
+                original=_ORIGINAL_SLOT,
+                counterfactual=_COUNTERFACTUAL_SLOT,
+                pattern_rule=pattern_rule,
+                target_label=target_label
+            )
+            skeleton = _SLOT_RE.split(rendered)
+            self._combined_skeletons[(pattern_rule, target_label)] = skeleton
+        
+        values = {_ORIGINAL_SLOT: original, _COUNTERFACTUAL_SLOT: counterfactual}
+        parts = list(skeleton)
+        parts[1::2] = [values[slot] for slot in skeleton[1::2]]
+        return "".join(parts)
+    
+    def _parse_combined_response(self, response, with_quality):
+        """Turn a raw combined-filter LLM response into scores
+        
+        with_quality: whether the prompt asked for the quality fields (pattern-guided items).
+        """
+        
+        # Grammar-constrained output always matches the schema: no repair or text fallback
+        if self.client.supports_grammar:
+            return self._combined_scores(extract_json_strict(response), with_quality)
+        
+        # Parse JSON response
+        result = self._parse_json_response(response)
+        if result:
+            return self._combined_scores(result, with_quality)
+        else:
+            # Fallback: parse individual scores from text
+            pkr_match = _PKR_RE.search(response)
+            lfr_match = _LFR_RE.search(response)
+            slfr_match = _SLFR_RE.search(response)
             
-            # Find JSON object
-            i = response.find("{")
-            j = response.rfind("}")
+            pkr_score = float(pkr_match.group(1)) if pkr_match else 0.5
+            lfr_score = float(lfr_match.group(1)) if lfr_match else 0.0
+            slfr_score = float(slfr_match.group(1)) if slfr_match else 0.0
             
-            if i != -1 and j != -1 and j > i:
-                json_str = response[i:j+1]
-                return json.loads(json_str)
+            # Handle percentage format
+            if pkr_score > 1.0:
+                pkr_score = pkr_score / 100.0
+            if lfr_score > 1.0:
+                lfr_score = lfr_score / 100.0
+            if slfr_score > 1.0:
+                slfr_score = slfr_score / 100.0
             
-        except json.JSONDecodeError:
-            pass
+            # Clamp scores to [0,1]
+            pkr_score = min(max(pkr_score, 0.0), 1.0)
+            lfr_score = min(max(lfr_score, 0.0), 1.0)
+            slfr_score = min(max(slfr_score, 0.0), 1.0)
+            
+            return {
+                "pkr": pkr_score,
+                "lfr": lfr_score,
+                "slfr": slfr_score,
+                "quality": {field: 0.5 for field in _QUALITY_FIELDS} if with_quality else {},
+                "reason": "Combined evaluation parsed from text"
+            }
+    
+    def _combined_error_result(self, e):
+        """Default scores when the combined-filter LLM call fails"""
+        return {
+            "pkr": 0.5,
+            "lfr": 0.0,
+            "slfr": 0.0,
+            "quality": {
+                "minimality": 0.5,
+                "fluency": 0.5,
+                "label_determinism": 0.5,
+                "faithfulness": 0.5
+            },
+            "reason": f"Error in combined evaluation: {str(e)[:50]}"
+        }
+
+    def _combined_filter_batch(self, items):
+        """Combined C2+C3 filter for many candidates in a single LLM call (OPTIMIZATION)
+        
+        Cached items skip the LLM; items missing from the model's answer fall back to
+        per-item _combined_filter calls.
+        """
+        keys = [self._cache_key(item["original"], item["counterfactual"], item.get("pattern_info"), item["target_label"])
+                for item in items]
+        combined_results = [self._cache_get(key) for key in keys]
+        uncached = [n for n, result in enumerate(combined_results) if result is None]
+        # Items with and without a pattern rule go out in separate batches, so each gets the same
+        # prompt variant (with / without quality fields) as the per-item call its cache key stands for
+        for with_rule in (True, False):
+            group = [n for n in uncached if bool(self._pattern_rule(items[n].get("pattern_info"))) == with_rule]
+            if not group:
+                continue
+            fresh = self._combined_filter_batch_llm([items[n] for n in group])
+            for n, result in zip(group, fresh):
+                combined_results[n] = result
+        return combined_results
+    
+    def _combined_filter_batch_llm(self, items):
+        """Score items with one row-marshaled LLM call
+        
+        Items the model's answer leaves out (or garbles) are re-asked together in a single
+        stricter retry batch; only what is still missing after that falls back per item.
+        """
+        by_pos = self._score_batch(items)
+        missing = [n for n in range(len(items)) if n not in by_pos]
+        if missing:
+            retried = self._score_batch([items[n] for n in missing], retry=True)
+            for m, n in enumerate(missing):
+                if m in retried:
+                    by_pos[n] = retried[m]
         
-        return None
\ No newline at end of file
+        combined_results = []
+        for n, item in enumerate(items):
+            if n in by_pos:
+                self._cache_set(self._cache_key(item["original"], item["counterfactual"], item.get("pattern_info"), item["target_label"]), by_pos[n])
+                combined_results.append(by_pos[n])
+            else:
+                combined_results.append(self._combined_filter(
+                    item["original"], item["counterfactual"], item.get("pattern_info"), item["target_label"]
+                ))
+        return combined_results
+    
+    def _score_batch(self, items, retry=False):
+        """One batch-prompt LLM call; returns {position in items: scores} for the parsed entries
+        
+        items all have a pattern rule or all lack one (see _combined_filter_batch).
+        """
+        rows = [
+            {
+                "i": n,
+                "original": item["original"],
+                "counterfactual": item["counterfactual"],
+                "pattern_rule": self._pattern_rule(item.get("pattern_info")),
+                "target_label": item["target_label"]
+            }
+            for n, item in enumerate(items, 1)
+        ]
+        # Quality fields are only requested for pattern-guided items
+        with_quality = any(row["pattern_rule"] for row in rows)
+        prompt = self.combined_batch_template.render(items=rows, with_quality=with_quality, retry=retry)
+        grammar = COMBINED_FILTER_BATCH_GRAMMAR if with_quality else COMBINED_NO_QUALITY_BATCH_GRAMMAR
+        
+        # 400 tokens per item, capped so a large batch cannot ask for an unbounded completion
+        max_tokens = min(400 * len(items), int(self.cfg.get("filter_batch_max_tokens", 4096)))
+        
+        by_pos = {}
+        try:
+            response = self.client.run(prompt, max_tokens=max_tokens, retries=1, grammar=grammar)
+        except (requests.RequestException, ValueError) as e:
+            # Every item falls back to the retry batch / per-item path
+            log.warning("Combined-filter batch of {} items failed: {}", len(items), e)
+            return by_pos
+        result = self._parse_json_response(response)
+        entries = result.get("results", []) if isinstance(result, dict) else []
+        if not isinstance(entries, list):
+            entries = []
+        for entry in entries:
+            # A malformed entry (not an object, bad idx or score) is left out: its item goes to
+            # the retry batch / per-item path
+            try:
+                idx = int(entry["idx"])
+                if 1 <= idx <= len(items):
+                    by_pos[idx - 1] = self._combined_scores(entry, with_quality)
+            except (AttributeError, KeyError, TypeError, ValueError):
+                continue
+        return by_pos
+    
+    def _combined_scores(self, result, with_quality):
+        """Extract and clamp combined C2+C3 scores from a parsed JSON object
+        
+        with_quality: the prompt asked for the quality fields; any the model left out default
+        to 0.5. Responses to the no-quality prompt get an empty "quality" (scored as 0.5 each).
+        """
+        
+        # Extract all scores
+        pkr_score = float(result.get("pkr_score", 0.5))
+        lfr_score = float(result.get("lfr_score", 0.0))
+        slfr_score = float(result.get("slfr_score", 0.0))
+        reason = result.get("overall_reason", "Combined evaluation completed")
+        
+        # Clamp all scores to [0,1]
+        pkr_score = min(max(pkr_score, 0.0), 1.0)
+        lfr_score = min(max(lfr_score, 0.0), 1.0)
+        slfr_score = min(max(slfr_score, 0.0), 1.0)
+        
+        quality = {}
+        if with_quality:
+            quality = {field: min(max(float(result.get(field, 0.5)), 0.0), 1.0) for field in _QUALITY_FIELDS}
+        
+        return {
+            "pkr": pkr_score,
+            "lfr": lfr_score,
+            "slfr": slfr_score,
+            "quality": quality,
+            "reason": reason
+        }
+    
+    def _pattern_rule(self, pattern_info):
+        """Pattern rule to show the filter (only for pattern-guided candidates)"""
+        if pattern_info and pattern_info.get("strategy") == "pattern_guided":
+            return pattern_info.get("pattern_rule", "")
+        return ""
+
+    def _parse_json_response(self, response):
+        """Parse JSON from LLM response (None if there is no valid object)"""
+        # Handles markdown code blocks and stops at the first balanced object
+        return extract_json(response)
\ No newline at end of file
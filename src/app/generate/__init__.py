@@ -0,0 +1,4 @@
+# Counterfactual Generation Module
+from .minimal_edit import generate_cf, generate_cf_with_patterns
+
+__all__ = ["generate_cf", "generate_cf_with_patterns"]
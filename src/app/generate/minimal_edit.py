@@ -1,75 +1,49 @@
 import json
-from pathlib import Path
-from jinja2 import Template
-from ..llm.ollama import OllamaClient
+import re
+from ..llm.factory import get_client
+from ..llm.grammars import COUNTERFACTUALS_GRAMMAR
+from ..utils.jinja_env import ENV
+from ..utils.json_fast import extract_json_strict, json_text
+
+__all__ = ["generate_cf", "generate_cf_with_patterns"]
+
+# Trailing commas before a closing bracket/brace, a common generator slip
+_TRAILING_COMMA_RE = re.compile(r',\s*([}\]])')
+# Last-resort salvage of counterfactual texts from unparseable output
+_TEXT_FIELD_RE = re.compile(r'"text":\s*"([^"]*)"')
 
 def _render(template_path: str, **kwargs) -> str:
-    tpl = Template(Path(template_path).read_text())
-    return tpl.render(**kwargs)
+    return ENV.get_template(template_path).render(**kwargs)
+
+def _normalize(data):
+    """Coerce the old single-counterfactual schema to the counterfactuals-list schema"""
+    if "counterfactual" in data:
+        return {
+            "counterfactuals": [
+                {
+                    "text": data["counterfactual"],
+                    "modification_focus": "general"
+                }
+            ]
+        }
+    elif "counterfactuals" in data:
+        return data
+    else:
+        raise ValueError("Invalid JSON structure")
 
 def _strict_json(s: str):
-    # Handle markdown code blocks
-    if "```json" in s:
-        start = s.find("```json") + 7
-        end = s.find("```", start)
-        if end != -1:
-            s = s[start:end].strip()
-    
-    i = s.find("{"); j = s.rfind("}")
-    if i == -1 or j == -1 or j <= i: raise ValueError("No JSON in LLM output")
-    
-    json_str = s[i:j+1]
     try:
-        data = json.loads(json_str)
-        
-        # Handle both old format (single counterfactual) and new format (multiple)
-        if "counterfactual" in data:
-            # Convert old format to new format
-            return {
-                "counterfactuals": [
-                    {
-                        "text": data["counterfactual"],
-                        "modification_focus": "general"
-                    }
-                ]
-            }
-        elif "counterfactuals" in data:
-            return data
-        else:
-            raise ValueError("Invalid JSON structure")
-            
+        return _normalize(extract_json_strict(s))
     except json.JSONDecodeError as e:
-        # Try to fix common escape sequence issues
-        import re
-        # Fix common problematic escape sequences
-        fixed_json = json_str.replace('\\n', '\\\\n').replace('\\t', '\\\\t').replace('\\r', '\\\\r')
-        # Fix unescaped backslashes
-        fixed_json = re.sub(r'(?<!\\)\\(?!["\\/bfnrt])', r'\\\\', fixed_json)
-        # Fix trailing commas before closing brackets/braces
-        fixed_json = re.sub(r',\s*([}\]])', r'\1', fixed_json)
-        # Fix missing quotes around keys (common issue)
-        fixed_json = re.sub(r'(\w+):', r'"\1":', fixed_json)
-        
+        # Rare path: the stdlib parser in non-strict mode accepts raw control characters
+        # (e.g. literal newlines) inside strings, which is the usual LLM slip
+        json_str = json_text(s)
         try:
-            data = json.loads(fixed_json)
-            # Apply same format conversion logic
-            if "counterfactual" in data:
-                return {
-                    "counterfactuals": [
-                        {
-                            "text": data["counterfactual"],
-                            "modification_focus": "general"
-                        }
-                    ]
-                }
-            elif "counterfactuals" in data:
-                return data
-            else:
-                raise ValueError("Invalid JSON structure")
+            # Fix trailing commas before closing brackets/braces
+            return _normalize(json.loads(_TRAILING_COMMA_RE.sub(r'\1', json_str), strict=False))
         except json.JSONDecodeError:
             # Last resort: try to extract text using regex if JSON is completely broken
-            text_pattern = r'"text":\s*"([^"]*)"'
-            texts = re.findall(text_pattern, json_str)
+            texts = _TEXT_FIELD_RE.findall(json_str)
             if texts:
                 return {
                     "counterfactuals": [
@@ -84,7 +58,7 @@ def _strict_json(s: str):
 def generate_cf_with_patterns(cfg, task_cfg, original_text: str, from_label: str, to_label: str, candidate_info=None):
     """Generate counterfactual with optional pattern guidance"""
     
-    client = OllamaClient(cfg["model_gen"], temperature=cfg["temperature"])
+    client = get_client(cfg, cfg["model_gen"], temperature=cfg["temperature"])
     
     # Use pattern-aware template if candidate info is provided
     if candidate_info and candidate_info.get("strategy") == "pattern_guided":
@@ -104,6 +78,10 @@ def generate_cf_with_patterns(cfg, task_cfg, original_text: str, from_label: str
                         from_label=from_label, 
                         to_label=to_label)
     
+    if client.supports_grammar:
+        # Output is constrained to the {"counterfactuals": [...]} schema: no repair or retry needed
+        out = client.run(prompt, system=None, max_tokens=cfg["cf_max_new"], retries=1, grammar=COUNTERFACTUALS_GRAMMAR)
+        return extract_json_strict(out)
     out = client.run(prompt, system=None, max_tokens=cfg["cf_max_new"], retries=1)
     try:
         return _strict_json(out)
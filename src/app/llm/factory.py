@@ -0,0 +1,36 @@
+from functools import lru_cache
+
+from .llamacpp import LlamaCppClient
+from .ollama import OllamaClient
+from .vllm import VLLMClient
+
+
+def make_client(cfg, model: str, temperature: float = 0.25, system: str | None = None):
+    """LLM client for the backend named by cfg["runner"] ("ollama", "llamacpp" or "vllm")
+
+    Every client exposes run(prompt, system, max_tokens, retries, timeout, grammar), an
+    async arun() with the same arguments, run_batch(prompts, max_tokens, retries, timeout) and
+    close(), so call sites do not depend on the backend.
+    """
+    runner = cfg.get("runner", "ollama")
+    if runner == "llamacpp":
+        return LlamaCppClient(model, host=cfg.get("llamacpp_host"), temperature=temperature, system=system)
+    if runner == "vllm":
+        return VLLMClient(model, host=cfg.get("vllm_host"), temperature=temperature, system=system)
+    if runner == "ollama":
+        return OllamaClient(model, host=cfg.get("ollama_host"), temperature=temperature, system=system, keep_alive=cfg.get("ollama_keep_alive", "10m"))
+    raise ValueError(f"Unknown runner: {runner}")
+
+@lru_cache(maxsize=32)
+def _shared_client(runner: str, host: str | None, model: str, temperature: float, system: str | None):
+    cfg = {"runner": runner, f"{runner}_host": host}
+    return make_client(cfg, model, temperature=temperature, system=system)
+
+def get_client(cfg, model: str, temperature: float = 0.25, system: str | None = None):
+    """Process-wide shared client for (backend, model, temperature, system)
+
+    Clients hold no per-request state, so per-call helpers reuse one instance instead of
+    constructing a client on every call.
+    """
+    runner = cfg.get("runner", "ollama")
+    return _shared_client(runner, cfg.get(f"{runner}_host"), model, temperature, system)
@@ -0,0 +1,63 @@
+"""
+GBNF grammars for llama.cpp-constrained JSON output.
+
+Each grammar pins the exact object shape a prompt asks for, so a grammar-capable
+client never returns malformed JSON and callers can parse its output directly.
+"""
+
+import json
+
+_COMMON_RULES = r'''
+score  ::= "0" ("." [0-9] [0-9]? [0-9]?)? | "1" ("." "0" "0"? "0"?)?
+int    ::= [1-9] [0-9]*
+string ::= "\"" ( [^"\\\x7F\x00-\x1F] | "\\" ["\\/bfnrt] )* "\""
+ws     ::= [ \t\n]? [ \t]*
+'''
+
+_CORE_SCORE_FIELDS = ("pkr_score", "lfr_score", "slfr_score")
+_QUALITY_FIELDS = ("minimality", "fluency", "label_determinism", "faithfulness")
+
+
+def _literal(text: str) -> str:
+    """GBNF literal matching the JSON encoding of text (including its quotes)"""
+    return json.dumps(json.dumps(text))
+
+
+def _object(fields) -> str:
+    """GBNF sequence for a JSON object with the given (key, rule) fields in order"""
+    members = ' "," ws '.join(f'{_literal(key)} ws ":" ws {rule}' for key, rule in fields)
+    return f'"{{" ws {members} ws "}}"'
+
+
+def _scores_fields(with_quality):
+    names = _CORE_SCORE_FIELDS + (_QUALITY_FIELDS if with_quality else ())
+    return [(name, "score") for name in names] + [("overall_reason", "string")]
+
+
+def _batch_grammar(with_quality):
+    return (
+        f'root ::= {_object([("results", "results")])}\n'
+        'results ::= "[" ws item ("," ws item)* ws "]"\n'
+        f'item ::= {_object([("idx", "int")] + _scores_fields(with_quality))}\n'
+        + _COMMON_RULES
+    )
+
+
+COMBINED_FILTER_GRAMMAR = f"root ::= {_object(_scores_fields(True))}\n" + _COMMON_RULES
+COMBINED_NO_QUALITY_GRAMMAR = f"root ::= {_object(_scores_fields(False))}\n" + _COMMON_RULES
+
+COMBINED_FILTER_BATCH_GRAMMAR = _batch_grammar(True)
+COMBINED_NO_QUALITY_BATCH_GRAMMAR = _batch_grammar(False)
+
+COUNTERFACTUALS_GRAMMAR = (
+    f'root ::= {_object([("counterfactuals", "cfs")])}\n'
+    'cfs ::= "[" ws cf ("," ws cf)* ws "]"\n'
+    f'cf ::= {_object([("text", "string"), ("modification_focus", "string")])}\n'
+    + _COMMON_RULES
+)
+
+
+def label_grammar(labels) -> str:
+    """Grammar for {"label": <one of labels>}"""
+    choices = " | ".join(_literal(label) for label in labels)
+    return f'root ::= {_object([("label", "label")])}\nlabel ::= {choices}\n' + _COMMON_RULES
@@ -0,0 +1,68 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from .ollama import get_session
+
+
+class LlamaCppClient:
+    """Thin client for llama.cpp's `llama-server` /completion endpoint
+
+    Unlike Ollama it accepts a GBNF grammar per request, so callers that pass one get
+    output that always matches their JSON schema and can skip the parse-repair/retry path.
+    """
+    supports_grammar = True
+
+    def __init__(self, model: str, host: str | None = None, temperature: float = 0.25, session: requests.Session | None = None,
+                 system: str | None = None):
+        # llama-server serves the single model it was started with; `model` is kept for logging/cache keys
+        self.model = model
+        self.temperature = temperature
+        self.host = host or os.getenv("LLAMACPP_HOST", "http://localhost:8080")
+        self.url = f"{self.host}/completion"
+        self.session = session or get_session()
+        self.system_default = system
+
+    def run(self, prompt: str, system: str | None = None, max_tokens: int = 64, retries: int = 1, timeout: int = 600,
+            grammar: str | None = None) -> str:
+        system = system or self.system_default
+        payload = {
+            "prompt": prompt if not system else f"{system}\n\n{prompt}",
+            "n_predict": max_tokens,
+            "temperature": self.temperature,
+            # Reuse the KV cache for the shared prompt prefix between requests
+            "cache_prompt": True,
+            "stream": False,
+        }
+        if grammar:
+            payload["grammar"] = grammar
+        for attempt in range(retries + 1):
+            try:
+                r = self.session.post(self.url, json=payload, timeout=timeout)
+                r.raise_for_status()
+                return r.json().get("content", "")
+            except Exception:
+                if attempt >= retries:
+                    raise
+                time.sleep(0.5 * (attempt + 1))
+
+    def run_batch(self, prompts: list[str], max_tokens: int = 64, retries: int = 1, timeout: int = 600,
+                  max_workers: int = 16) -> list[str]:
+        """Completions for many prompts, up to max_workers requests in flight (llama-server --parallel slots)"""
+        if not prompts:
+            return []
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(prompts))) as executor:
+            return list(executor.map(lambda p: self.run(p, None, max_tokens, retries, timeout), prompts))
+
+    def close(self):
+        """Release a session passed in by the caller; the process-wide shared pool stays open"""
+        if self.session is not get_session():
+            self.session.close()
+
+    async def arun(self, prompt: str, system: str | None = None, max_tokens: int = 64, retries: int = 1, timeout: int = 600,
+                   grammar: str | None = None) -> str:
+        """Async variant of run; the blocking request runs in a worker thread so callers can gather many"""
+        return await asyncio.to_thread(self.run, prompt, system, max_tokens, retries, timeout, grammar)
@@ -1,27 +1,161 @@
-import requests, os, time
-from typing import Optional
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def _make_session() -> requests.Session:
+    session = requests.Session()
+    # Keep at least as many pooled connections as requests we may have in flight at once
+    # (filter concurrency x parallel rows), so concurrent calls never open throwaway sockets
+    pool_maxsize = int(os.getenv("LLM_POOL_MAXSIZE", "64"))
+    adapter = HTTPAdapter(pool_connections=32, pool_maxsize=pool_maxsize, pool_block=False)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["Connection"] = "keep-alive"
+    return session
+
+# One keep-alive connection pool shared by every client in the process
+_SESSION = _make_session()
+
+def get_session() -> requests.Session:
+    return _SESSION
+
+class _ObjectCloseTracker:
+    """Incremental brace-depth scanner: feed() returns True once the first top-level {...} closes"""
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, text: str) -> bool:
+        for ch in text:
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == "{":
+                self.depth += 1
+            elif self.depth == 0:
+                # Text before the object (prose, code fences) is ignored, quotes included
+                continue
+            elif ch == '"':
+                self.in_string = True
+            elif ch == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    return True
+        return False
 
 class OllamaClient:
-    def __init__(self, model: str, host: Optional[str] = None, temperature: float = 0.25):
+    # Ollama has no GBNF support: `grammar` is accepted by run() so clients are interchangeable, but ignored
+    supports_grammar = False
+
+    def __init__(self, model: str, host: str | None = None, temperature: float = 0.25, session: requests.Session | None = None,
+                 system: str | None = None, keep_alive: str = "10m"):
         self.model = model
         self.temperature = temperature
         self.host = host or os.getenv("OLLAMA_HOST", "http://localhost:11434")
         self.url = f"{self.host}/api/generate"
+        self.chat_url = f"{self.host}/api/chat"
+        self.session = session or get_session()
+        # Default system prompt for every run() that does not pass its own
+        self.system_default = system
+        # Keep the model (and its prompt cache) resident between calls
+        self.keep_alive = keep_alive
 
-    def run(self, prompt: str, system: Optional[str] = None, max_tokens: int = 64, retries: int = 1, timeout: int = 600) -> str:
-        full_prompt = prompt if not system else f"<|system|>\n{system}\n<|user|>\n{prompt}"
-        payload = {
+    def _request(self, prompt: str, system: str | None, max_tokens: int, stream: bool):
+        """(url, payload) for a generation request"""
+        options = {"temperature": self.temperature, "num_predict": max_tokens}
+        if system:
+            # Chat endpoint with the fixed system prompt as its own leading message: the shared
+            # prefix is identical across calls, so Ollama reuses its KV instead of re-prefilling it
+            return self.chat_url, {
+                "model": self.model,
+                "messages": [{"role": "system", "content": system}, {"role": "user", "content": prompt}],
+                "options": options,
+                "stream": stream,
+                "keep_alive": self.keep_alive,
+            }
+        return self.url, {
             "model": self.model,
-            "prompt": full_prompt,
-            "options": {"temperature": self.temperature, "num_predict": max_tokens},
-            "stream": False,
+            "prompt": prompt,
+            "options": options,
+            "stream": stream,
+            "keep_alive": self.keep_alive,
         }
+
+    def run(self, prompt: str, system: str | None = None, max_tokens: int = 64, retries: int = 1, timeout: int = 600,
+            grammar: str | None = None) -> str:
+        system = system or self.system_default
+        url, payload = self._request(prompt, system, max_tokens, stream=False)
         for attempt in range(retries + 1):
             try:
-                r = requests.post(self.url, json=payload, timeout=timeout)
+                r = self.session.post(url, json=payload, timeout=timeout)
                 r.raise_for_status()
-                return r.json().get("response", "")
+                data = r.json()
+                if system:
+                    return data.get("message", {}).get("content", "")
+                return data.get("response", "")
+            except Exception:
+                if attempt >= retries:
+                    raise
+                time.sleep(0.5 * (attempt + 1))
+
+    def run_stream(self, prompt: str, system: str | None = None, max_tokens: int = 64, retries: int = 1, timeout: int = 600) -> str:
+        """Like run, but streams tokens and stops as soon as the first JSON object is complete
+
+        Closing the response drops the connection, which makes Ollama stop decoding; the
+        model stays loaded (no keep_alive=0 unload).
+        """
+        system = system or self.system_default
+        url, payload = self._request(prompt, system, max_tokens, stream=True)
+        for attempt in range(retries + 1):
+            try:
+                with self.session.post(url, json=payload, timeout=timeout, stream=True) as r:
+                    r.raise_for_status()
+                    tracker = _ObjectCloseTracker()
+                    chunks = []
+                    for line in r.iter_lines():
+                        if not line:
+                            continue
+                        data = json.loads(line)
+                        text = data.get("message", {}).get("content", "") if system else data.get("response", "")
+                        chunks.append(text)
+                        if tracker.feed(text) or data.get("done"):
+                            break
+                    return "".join(chunks)
             except Exception:
                 if attempt >= retries:
                     raise
                 time.sleep(0.5 * (attempt + 1))
+
+    def run_batch(self, prompts: list[str], max_tokens: int = 64, retries: int = 1, timeout: int = 600,
+                  max_workers: int = 16) -> list[str]:
+        """Completions for many prompts, up to max_workers requests in flight; results keep prompt order
+
+        Ollama serves them concurrently up to OLLAMA_NUM_PARALLEL and reuses the KV cache of the
+        shared prompt prefix.
+        """
+        if not prompts:
+            return []
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(prompts))) as executor:
+            return list(executor.map(lambda p: self.run(p, None, max_tokens, retries, timeout), prompts))
+
+    def close(self):
+        """Release a session passed in by the caller; the process-wide shared pool stays open"""
+        if self.session is not get_session():
+            self.session.close()
+
+    async def arun(self, prompt: str, system: str | None = None, max_tokens: int = 64, retries: int = 1, timeout: int = 600,
+                   grammar: str | None = None) -> str:
+        """Async variant of run; the blocking request runs in a worker thread so callers can gather many"""
+        return await asyncio.to_thread(self.run, prompt, system, max_tokens, retries, timeout, grammar)
@@ -0,0 +1,105 @@
+import asyncio
+import functools
+import os
+import time
+
+import requests
+
+from .ollama import get_session
+
+
+@functools.lru_cache(maxsize=4)
+def _load_tokenizer(model: str):
+    """Local Hugging Face tokenizer for a served model, or None when transformers cannot load it"""
+    try:
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(model)
+    except (ImportError, OSError, ValueError):
+        return None
+
+class VLLMClient:
+    """Client for a vLLM server's OpenAI-compatible API
+
+    run() uses /v1/chat/completions; run_batch() sends many prompts in one
+    /v1/completions request so vLLM can schedule them together (continuous batching).
+    """
+    # vLLM's guided decoding takes Lark/EBNF, not GBNF: `grammar` is accepted but ignored
+    supports_grammar = False
+
+    def __init__(self, model: str, host: str | None = None, temperature: float = 0.25, session: requests.Session | None = None,
+                 system: str | None = None):
+        self.model = model
+        self.temperature = temperature
+        self.host = host or os.getenv("VLLM_HOST", "http://localhost:8000")
+        self.chat_url = f"{self.host}/v1/chat/completions"
+        self.completions_url = f"{self.host}/v1/completions"
+        self.session = session or get_session()
+        self.system_default = system
+
+    def _post(self, url: str, payload: dict, retries: int, timeout: int) -> dict:
+        for attempt in range(retries + 1):
+            try:
+                r = self.session.post(url, json=payload, timeout=timeout)
+                r.raise_for_status()
+                return r.json()
+            except Exception:
+                if attempt >= retries:
+                    raise
+                time.sleep(0.5 * (attempt + 1))
+
+    def run(self, prompt: str, system: str | None = None, max_tokens: int = 64, retries: int = 1, timeout: int = 600,
+            grammar: str | None = None) -> str:
+        system = system or self.system_default
+        messages = [{"role": "system", "content": system}] if system else []
+        messages.append({"role": "user", "content": prompt})
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": self.temperature,
+            "max_tokens": max_tokens,
+        }
+        data = self._post(self.chat_url, payload, retries, timeout)
+        choices = data.get("choices") or [{}]
+        return choices[0].get("message", {}).get("content", "")
+
+    def run_batch(self, prompts: list[str | list[int]], max_tokens: int = 64, retries: int = 1, timeout: int = 600) -> list[str]:
+        """Complete many raw prompts (strings or token id lists) in one request; outputs are returned in prompt order"""
+        if not prompts:
+            return []
+        payload = {
+            "model": self.model,
+            "prompt": list(prompts),
+            "temperature": self.temperature,
+            "max_tokens": max_tokens,
+        }
+        data = self._post(self.completions_url, payload, retries, timeout)
+        outputs = [""] * len(prompts)
+        for choice in data.get("choices", []):
+            outputs[choice.get("index", 0)] = choice.get("text", "")
+        return outputs
+
+    def run_batch_prefixed(self, prefix: str, texts: list[str], suffix: str = "", max_tokens: int = 64, retries: int = 1,
+                           timeout: int = 600) -> list[str]:
+        """run_batch over prefix + text + suffix prompts, sent as token ids
+
+        The shared prefix and suffix are tokenized once and only each text per prompt, so
+        the server neither re-tokenizes the prefix nor misses its prefix KV cache. Falls back
+        to string prompts when the model's tokenizer is not available locally.
+        """
+        tokenizer = _load_tokenizer(self.model)
+        if tokenizer is None:
+            return self.run_batch([f"{prefix}{text}{suffix}" for text in texts], max_tokens, retries, timeout)
+        prefix_ids = tokenizer.encode(prefix)
+        suffix_ids = tokenizer.encode(suffix, add_special_tokens=False)
+        prompts = [prefix_ids + tokenizer.encode(text, add_special_tokens=False) + suffix_ids for text in texts]
+        return self.run_batch(prompts, max_tokens, retries, timeout)
+
+    def close(self):
+        """Release a session passed in by the caller; the process-wide shared pool stays open"""
+        if self.session is not get_session():
+            self.session.close()
+
+    async def arun(self, prompt: str, system: str | None = None, max_tokens: int = 64, retries: int = 1, timeout: int = 600,
+                   grammar: str | None = None) -> str:
+        """Async variant of run; the blocking request runs in a worker thread so callers can gather many"""
+        return await asyncio.to_thread(self.run, prompt, system, max_tokens, retries, timeout, grammar)
@@ -1,16 +1,22 @@
-import json
-import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from jinja2 import Template
-from ..llm.ollama import OllamaClient
+from ..llm.factory import make_client
+from ..utils.cache import DiskCache, hash_key
 from ..utils.io import write_json
+from ..utils.jinja_env import ENV
+from ..utils.json_fast import extract_json, loads
 import datetime
 
 class NeuroSymbolicPatternLearner:
     def __init__(self, cfg):
-        self.client = OllamaClient(cfg["model_gen"], temperature=0.1)
+        self.client = make_client(cfg, cfg["model_gen"], temperature=0.1)
         self.cfg = cfg
         self.patterns_cache = {}
+        # Created once here; load/save reuse it instead of re-checking the directory on every call
+        self.patterns_dir = Path("reports/patterns")
+        self.patterns_dir.mkdir(parents=True, exist_ok=True)
+        # Per-label LLM responses keyed by prompt, so reruns only query labels whose inputs changed
+        self.response_cache = DiskCache(self.patterns_dir / ".cache") if cfg.get("pattern_cache", True) else None
         
     def get_patterns_filename(self, task_name, model_name):
         """Generate consistent filename for patterns"""
@@ -19,15 +25,11 @@ class NeuroSymbolicPatternLearner:
     
     def load_existing_patterns(self, task_name, model_name):
         """Load patterns from cache if they exist"""
-        patterns_dir = Path("reports/patterns")
-        patterns_dir.mkdir(parents=True, exist_ok=True)
-        
-        patterns_file = patterns_dir / self.get_patterns_filename(task_name, model_name)
+        patterns_file = self.patterns_dir / self.get_patterns_filename(task_name, model_name)
         
         if patterns_file.exists():
             try:
-                with open(patterns_file, 'r') as f:
-                    patterns_data = json.load(f)
+                patterns_data = loads(patterns_file.read_bytes())
                 print(f"📁 Loaded existing patterns from: {patterns_file}")
                 return patterns_data.get("patterns", {})
             except Exception as e:
@@ -37,10 +39,7 @@ class NeuroSymbolicPatternLearner:
     
     def save_patterns(self, patterns, task_name, model_name, train_size):
         """Save patterns with metadata"""
-        patterns_dir = Path("reports/patterns")
-        patterns_dir.mkdir(parents=True, exist_ok=True)
-        
-        patterns_file = patterns_dir / self.get_patterns_filename(task_name, model_name)
+        patterns_file = self.patterns_dir / self.get_patterns_filename(task_name, model_name)
         
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
         patterns_data = {
@@ -55,7 +54,7 @@ class NeuroSymbolicPatternLearner:
         print(f"💾 Saved patterns to: {patterns_file}")
         
         # Also create a symlink to latest
-        latest_link = patterns_dir / f"patterns_{task_name}_latest.json"
+        latest_link = self.patterns_dir / f"patterns_{task_name}_latest.json"
         try:
             if latest_link.exists():
                 latest_link.unlink()
@@ -72,11 +71,9 @@ class NeuroSymbolicPatternLearner:
         sample_examples = examples[:8] if len(examples) > 8 else examples
         other_labels = [l for l in all_labels if l != label]
         
-        # Load and render the centralized pattern learning prompt
-        prompt_path = Path("prompts/patterns/pattern_learning.txt")
+        # Render the centralized pattern learning prompt (compiled once by the shared environment)
         try:
-            with open(prompt_path, 'r') as f:
-                template = Template(f.read())
+            template = ENV.get_template("prompts/patterns/pattern_learning.txt")
             
             # Convert examples to the expected format
             example_dicts = [{"text": ex} for ex in sample_examples]
@@ -89,12 +86,13 @@ class NeuroSymbolicPatternLearner:
         except Exception as e:
             print(f"    Error loading pattern template: {e}")
             # Fallback to inline prompt with English enforcement
+            example_lines = "\n".join(f'- "{ex}"' for ex in sample_examples)
             prompt = f"""You are an English-speaking linguistic analyzer specializing in pattern recognition. Respond ONLY in English.
 
 TASK: Analyze examples labeled as "{label}" and learn symbolic patterns using Programming-by-Example approach.
 
 EXAMPLES FOR LABEL "{label}":
-{chr(10).join([f"- \"{ex}\"" for ex in sample_examples])}
+{example_lines}
 
 OTHER LABELS: {', '.join(other_labels)}
 
@@ -127,9 +125,22 @@ OUTPUT (JSON only, all text in English):
 
 Respond with JSON only. Use English for all text fields."""
 
+        system = "You are an English-speaking assistant. Always respond in English only."
+        # Keyed on backend and sampling too: another runner or temperature gives different answers
+        key = hash_key(self.cfg.get("runner", "ollama"), self.client.model, self.client.temperature, system, prompt)
+        cached = self.response_cache.get(key) if self.response_cache is not None else None
+        if cached is not None:
+            return self._parse_patterns(cached)
+
         try:
-            response = self.client.run(prompt, system="You are an English-speaking assistant. Always respond in English only.", max_tokens=512, retries=1)
-            return self._parse_patterns(response)
+            # Stop decoding once the JSON object is complete when the backend can stream
+            run = getattr(self.client, "run_stream", self.client.run)
+            response = run(prompt, system=system, max_tokens=512, retries=1)
+            patterns = self._parse_patterns(response)
+            # Only cache usable answers so failed parses are retried on the next run
+            if patterns and self.response_cache is not None:
+                self.response_cache.set(key, response)
+            return patterns
         except Exception as e:
             print(f"    Error learning patterns for {label}: {e}")
             return []
@@ -179,25 +190,37 @@ Respond with JSON only. Use English for all text fields."""
         
         all_patterns = {}
         
+        # One pass over the rows groups every label's examples (instead of one mask per label)
+        examples_by_label = train_df.groupby(label_field, observed=True, sort=False)[text_field].agg(list).to_dict()
+        
+        to_learn = []
         for label in labels:
-            print(f"  Learning patterns for: {label}")
-            
-            label_examples = train_df[train_df[label_field] == label][text_field].tolist()
-            
+            label_examples = examples_by_label.get(label, [])
             if len(label_examples) < 2:
+                print(f"  Learning patterns for: {label}")
                 print(f"    Insufficient examples ({len(label_examples)}), using general patterns")
                 all_patterns[label] = []
-                continue
-            
-            print(f"    Analyzing {len(label_examples)} examples...")
-            patterns = self.learn_patterns_for_label(label_examples, label, labels)
-            all_patterns[label] = patterns
-            
-            print(f"    Learned {len(patterns)} patterns:")
-            for i, pattern in enumerate(patterns, 1):
-                rule = pattern.get('rule', 'N/A')
-                conf = pattern.get('confidence', 0)
-                print(f"      {i}. {rule} (conf: {conf:.2f})")
+            else:
+                to_learn.append(label)
+        
+        # Labels are independent and each is one blocking LLM request, so query them concurrently
+        if to_learn:
+            with ThreadPoolExecutor(max_workers=min(len(to_learn), 8)) as executor:
+                learned = executor.map(
+                    lambda label: self.learn_patterns_for_label(examples_by_label[label], label, labels), to_learn
+                )
+                for label, patterns in zip(to_learn, learned):
+                    all_patterns[label] = patterns
+                    print(f"  Learning patterns for: {label}")
+                    print(f"    Analyzed {len(examples_by_label[label])} examples")
+                    print(f"    Learned {len(patterns)} patterns:")
+                    for i, pattern in enumerate(patterns, 1):
+                        rule = pattern.get('rule', 'N/A')
+                        conf = pattern.get('confidence', 0)
+                        print(f"      {i}. {rule} (conf: {conf:.2f})")
+        
+        # Keep the label order of the task config in the saved file
+        all_patterns = {label: all_patterns[label] for label in labels}
         
         # Save the learned patterns
         self.save_patterns(all_patterns, task_name, model_name, len(train_df))
@@ -206,23 +229,8 @@ Respond with JSON only. Use English for all text fields."""
     
     def _parse_patterns(self, response):
         """Parse pattern learning response"""
-        try:
-            # Handle markdown code blocks
-            if "```json" in response:
-                start = response.find("```json") + 7
-                end = response.find("```", start)
-                if end != -1:
-                    response = response[start:end].strip()
-            
-            json_start = response.find('{')
-            json_end = response.rfind('}') + 1
-            
-            if json_start >= 0 and json_end > json_start:
-                json_str = response[json_start:json_end]
-                pattern_data = json.loads(json_str)
-                return pattern_data.get("patterns", [])
-            else:
-                return []
-                
-        except json.JSONDecodeError:
-            return []
\ No newline at end of file
+        # Handles markdown code blocks and stops at the first balanced object
+        pattern_data = extract_json(response)
+        if not isinstance(pattern_data, dict):
+            return []
+        return pattern_data.get("patterns", [])
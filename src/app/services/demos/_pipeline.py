@@ -0,0 +1,198 @@
+"""
+Per-row counterfactual demo pipeline shared by the demo entrypoints.
+
+Each row is generated, annotated and judged; the judge is pluggable so the same loop serves
+any filter that returns the VariationTheoryFilter result dict (pass_all, score, pkr, lfr,
+slfr, details, stage_failed, reason).
+"""
+
+import asyncio
+import re
+from collections.abc import Awaitable, Callable
+
+from ...annotate.llm_annotator import annotate_label_batch
+from ...generate.minimal_edit import generate_cf_with_patterns
+from ...utils.log import get_logger
+
+log = get_logger(queued=True)
+
+_WS_RE = re.compile(r"\s+")
+
+class _RowLog:
+    """Collects one row's log lines and emits them as a single record
+
+    Concurrent rows then print as contiguous blocks instead of interleaving line by line, and
+    each row costs one logging call instead of one per line.
+    """
+
+    def __init__(self):
+        self.lines = []
+
+    def __call__(self, message, *args):
+        self.lines.append(message.format(*args))
+
+    def flush(self):
+        if self.lines:
+            log.info("\n".join(self.lines))
+            self.lines = []
+
+JudgeFn = Callable[[list[dict]], Awaitable[list[dict]]]
+PrescreenFn = Callable[[str, str], bool]
+
+
+async def run_demo_pipeline(cfg, task_cfg, labels, jobs, pattern_learner, all_patterns, judge_fn: JudgeFn, row_parallel, result_key="filter", target=None,
+                            prescreen_fn: PrescreenFn | None = None):
+    """Run every (orig, orig_label, to_label) job with at most row_parallel rows in flight; results keep job order
+
+    judge_fn takes a list of {original, counterfactual, pattern_info, target_label} items and
+    returns one result dict per item; the winner's details are stored under result_key.
+    prescreen_fn(original, counterfactual), if given, drops candidates before they are annotated.
+    Once target candidates have been accepted, rows that have not started yet return
+    ("skipped", None) without any LLM calls (rows already in flight still finish).
+    """
+    semaphore = asyncio.Semaphore(row_parallel)
+    done = 0
+    accepted = 0
+
+    async def run_one(job):
+        nonlocal done, accepted
+        async with semaphore:
+            if target is not None and accepted >= target:
+                return "skipped", None
+            row_log = _RowLog()
+            try:
+                outcome = await _process_row(cfg, task_cfg, labels, *job, pattern_learner, all_patterns, judge_fn, result_key,
+                                             prescreen_fn, row_log)
+            finally:
+                row_log.flush()
+        done += 1
+        accepted += outcome[0] == "ok"
+        if done % 10 == 0 or done <= 5:
+            log.info("Progress: {:3d}/{} rows done", done, len(jobs))
+        return outcome
+
+    return await asyncio.gather(*[run_one(job) for job in jobs])
+
+async def _process_row(cfg, task_cfg, labels, orig, orig_label, to_label, pattern_learner, all_patterns, judge_fn, result_key, prescreen_fn, row_log):
+    """Generate, annotate and filter counterfactuals for one row
+
+    Returns ("ok", candidate), ("empty", None) or ("failed", None). The blocking generator and
+    annotator calls run in worker threads so other rows proceed meanwhile.
+    """
+    row_log("  Generating CF for: '{:.50}' [{} -> {}]", orig, orig_label, to_label)
+    
+    # STEP 4.1: Identify candidate phrases using learned patterns
+    candidate_info = pattern_learner.identify_candidate_phrases(orig, all_patterns, orig_label)
+    
+    row_log("    Strategy: {}", candidate_info['strategy'])
+    if candidate_info['strategy'] == 'pattern_guided':
+        row_log("    Pattern: {}", candidate_info['pattern_rule'])
+        row_log("    Modifiable: {}", candidate_info['phrases'])
+    
+    # STEP 4.2 & 4.3: Generate multiple counterfactual candidates (OPTIMIZED: 2-3 instead of 3-5)
+    try:
+        cf_obj = await asyncio.to_thread(generate_cf_with_patterns, cfg, task_cfg, orig, orig_label, to_label, candidate_info)
+        cf_candidates = cf_obj.get("counterfactuals", [])
+    except Exception as e:
+        row_log("    Failed CF generation: {!s:.50}...", e)
+        return "empty", None
+
+    if not cf_candidates:
+        row_log("    No counterfactual candidates generated")
+        return "empty", None
+
+    row_log("    Generated {} CF candidates", len(cf_candidates))
+
+    # STEP 5: Filter each candidate and select the best one (OPTIMIZED: Combined C2+C3 filter)
+    best_candidate = None
+    best_score = 0.0
+
+    # Verify label annotation first (all candidates concurrently); only label-matching
+    # candidates reach the VT filter
+    texts = []
+    seen = set()
+    for idx, cf_candidate in enumerate(cf_candidates):
+        cf_text = cf_candidate.get("text", "").strip()
+        modification_focus = cf_candidate.get("modification_focus", "unknown")
+        
+        if not cf_text:
+            continue
+        
+        row_log("      Candidate {}: '{:.40}'", idx+1, cf_text)
+        row_log("      Focus: {}", modification_focus)
+        # Same text up to case/whitespace as an earlier candidate: same label and filter result
+        key = _WS_RE.sub(" ", cf_text.lower())
+        if key in seen:
+            row_log("        Duplicate of an earlier candidate")
+            continue
+        seen.add(key)
+        # Cheap string checks first: candidates the filter would reject anyway skip annotation
+        if prescreen_fn is not None and not prescreen_fn(orig, cf_text):
+            row_log("        Rejected by prescreen")
+            continue
+        texts.append((idx, cf_text, modification_focus))
+    
+    anns = await asyncio.to_thread(annotate_label_batch, cfg, task_cfg, [cf_text for _, cf_text, _ in texts], labels)
+    
+    to_filter = []
+    for (idx, cf_text, modification_focus), ann in zip(texts, anns):
+        cf_label = ann.get("label", None)
+        if cf_label != to_label:
+            row_log("        Label mismatch: got '{}', expected '{}'", cf_label, to_label)
+            continue
+
+        row_log("        Label matches: '{}'", cf_label)
+        to_filter.append((idx, cf_text, cf_label, modification_focus))
+
+    # Apply optimized Variation Theory filter (C1 + Combined C2+C3) with concurrent LLM requests
+    vt_filter_results = await judge_fn([
+        {"original": orig, "counterfactual": cf_text, "pattern_info": candidate_info, "target_label": to_label}
+        for _, cf_text, _, _ in to_filter
+    ])
+
+    for (idx, cf_text, cf_label, modification_focus), vt_filter_result in zip(to_filter, vt_filter_results):
+        if vt_filter_result["pass_all"]:
+            score = vt_filter_result["score"]
+            pkr = vt_filter_result["pkr"]
+            lfr = vt_filter_result["lfr"] 
+            slfr = vt_filter_result["slfr"]
+            row_log("      Candidate {} passed VT filter! (score: {:.3f}, PKR: {:.3f}, LFR: {:.3f}, SLFR: {:.3f})", idx+1, score, pkr, lfr, slfr)
+            
+            # Keep the best scoring candidate
+            if score > best_score:
+                best_score = score
+                best_candidate = {
+                    "text": cf_text,
+                    "label": cf_label,
+                    "score": score,
+                    "modification_focus": modification_focus,
+                    result_key: vt_filter_result["details"],
+                    "pkr": pkr,
+                    "lfr": lfr,
+                    "slfr": slfr
+                }
+        else:
+            stage_failed = vt_filter_result["stage_failed"]
+            reason = vt_filter_result["reason"]
+            row_log("      Candidate {} failed VT filter at stage {}: {}", idx+1, stage_failed, reason)
+
+    # Use the best candidate if found
+    if not best_candidate:
+        row_log("    No candidates passed all filters")
+        return "failed", None
+
+    row_log("    Best candidate (score: {:.3f}): '{:.50}'", best_candidate['score'], best_candidate['text'])
+    
+    return "ok", {
+        "original": orig,
+        "original_label": orig_label,
+        "counterfactual": best_candidate["text"],
+        "counterfactual_label": best_candidate["label"],
+        "score": best_candidate["score"],
+        result_key: best_candidate[result_key],
+        # NEW: Add pattern information
+        "pattern_strategy": candidate_info['strategy'],
+        "pattern_rule": candidate_info.get('pattern_rule', 'N/A'),
+        "modifiable_parts": candidate_info.get('phrases', []),
+        "modification_focus": best_candidate["modification_focus"]
+    }
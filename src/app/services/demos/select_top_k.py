@@ -5,21 +5,116 @@ This allows experimenting with different K values without regenerating all candi
 """
 
 import argparse
-import json
+import functools
+import hashlib
+import numpy as np
 from pathlib import Path
 import sys
 import os
 
 # Add parent directory to path for imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
-from utils.io import write_json
+from utils.io import load_json_fast, resolve_latest, write_json
 
-def cosine(u, v):
-    import math
-    num = sum(x*y for x,y in zip(u,v))
-    du = math.sqrt(sum(x*x for x in u))
-    dv = math.sqrt(sum(x*x for x in v))
-    return num / max(1e-9, du*dv)
+EMBED_MODEL = "all-MiniLM-L6-v2"
+EMBED_CACHE_DIR = Path(".cache")
+
+@functools.lru_cache(maxsize=1)
+def _get_embedder():
+    """MiniLM sentence embedder, loaded once per process"""
+    import torch
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(EMBED_MODEL, device="cuda" if torch.cuda.is_available() else "cpu")
+
+def encode_cached(texts):
+    """Normalized float32 embeddings of texts, cached on disk by a hash of the model and texts
+
+    Re-running with another K or threshold on the same candidates skips the embedder entirely.
+    """
+    digest = hashlib.sha1(EMBED_MODEL.encode())
+    for text in texts:
+        # Length-prefixed, so ["a\nb"] and ["a", "b"] cannot share a key
+        data = text.encode("utf-8")
+        digest.update(len(data).to_bytes(8, "little") + data)
+    cache_path = EMBED_CACHE_DIR / f"embeds_{digest.hexdigest()[:16]}.npy"
+    if cache_path.exists():
+        return np.load(cache_path)
+    vecs = _get_embedder().encode(texts, normalize_embeddings=True, batch_size=128,
+                                  convert_to_numpy=True, show_progress_bar=False).astype(np.float32)
+    EMBED_CACHE_DIR.mkdir(exist_ok=True)
+    # Save to a temp file and rename so an interrupted run never leaves a truncated cache entry
+    tmp_path = cache_path.with_name(cache_path.stem + ".tmp.npy")
+    np.save(tmp_path, vecs)
+    os.replace(tmp_path, cache_path)
+    return vecs
+
+def rowwise_cosine(a, b):
+    """Cosine similarity of each row of a with the same row of b, in one vectorized pass"""
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    a = a / np.maximum(np.linalg.norm(a, axis=1, keepdims=True), 1e-9)
+    b = b / np.maximum(np.linalg.norm(b, axis=1, keepdims=True), 1e-9)
+    return np.einsum("ij,ij->i", a, b)
+
+INT8_SCALE = 127
+
+def similarity_matrix(vecs, embed_dtype="float32", raw_int=False):
+    """Pairwise cosine similarities of L2-normalized embeddings
+
+    With embed_dtype="int8" the vectors are quantized to [-127, 127] first (4x less memory);
+    the products are accumulated in int32 so 384-dim dot products cannot overflow. raw_int=True
+    returns those int32 products unscaled (cosine * INT8_SCALE**2), for callers that only
+    compare against a threshold and can scale the threshold instead.
+    """
+    # One contiguous float32 copy at most, so the matmul below goes straight to BLAS SGEMM
+    vecs = np.ascontiguousarray(vecs, dtype=np.float32)
+    if embed_dtype == "int8":
+        q = np.clip(np.round(vecs * INT8_SCALE), -INT8_SCALE, INT8_SCALE).astype(np.int8).astype(np.int32)
+        products = q @ q.T
+        return products if raw_int else products.astype(np.float32) / (INT8_SCALE * INT8_SCALE)
+    return vecs @ vecs.T
+
+def mmr_select(scores, sim, k, diversity_threshold, mmr_lambda):
+    """Pick k indices by maximal marginal relevance over a precomputed similarity matrix
+
+    Each pick maximizes score - mmr_lambda * (max similarity to the picks so far), where the
+    similarity only counts once it exceeds diversity_threshold. One vector update per pick.
+    """
+    n = len(scores)
+    max_sim = np.full(n, -1.0, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    picked = []
+    for _ in range(min(k, n)):
+        penalty = mmr_lambda * np.where(max_sim > diversity_threshold, max_sim, 0.0)
+        gain = np.where(available, scores - penalty, -np.inf)
+        i = int(np.argmax(gain))
+        picked.append(i)
+        available[i] = False
+        max_sim = np.maximum(max_sim, sim[i])
+    return picked
+
+def greedy_select_faiss(vecs, order, k, diversity_threshold, hnsw=False):
+    """Greedy diversity selection with a FAISS inner-product index over the picks so far
+
+    Same picks as the matrix path (exact with IndexFlatIP), but no NxN similarity matrix:
+    each candidate is one nearest-pick query, so memory stays O(N*d) for large candidate sets.
+    hnsw=True uses an approximate IndexHNSWFlat instead.
+    """
+    import faiss
+    vecs = np.ascontiguousarray(vecs, dtype=np.float32)
+    dim = vecs.shape[1]
+    index = faiss.IndexHNSWFlat(dim, 32, faiss.METRIC_INNER_PRODUCT) if hnsw else faiss.IndexFlatIP(dim)
+    picked = []
+    for i in order:
+        if len(picked) >= k:
+            break
+        if index.ntotal:
+            nearest, _ = index.search(vecs[i:i + 1], 1)
+            if nearest[0, 0] > diversity_threshold:
+                continue
+        picked.append(i)
+        index.add(vecs[i:i + 1])
+    return picked
 
 def main():
     ap = argparse.ArgumentParser(description="Select top-K demos from saved candidates")
@@ -27,8 +122,26 @@ def main():
     ap.add_argument("--k", type=int, required=True, help="Number of demos to select")
     ap.add_argument("--diversity-threshold", type=float, default=0.9, 
                     help="Cosine similarity threshold for diversity filtering")
+    ap.add_argument("--selection", choices=["greedy", "mmr"], default="greedy",
+                    help="greedy: skip candidates too similar to a pick; mmr: penalize similarity instead")
+    ap.add_argument("--mmr-lambda", type=float, default=0.5,
+                    help="Similarity penalty weight for --selection mmr")
+    ap.add_argument("--embed-dtype", choices=["float32", "int8"], default="float32",
+                    help="Precision of the embeddings used for the similarity matrix")
+    ap.add_argument("--nn-index", choices=["matrix", "faiss", "faiss-hnsw"], default="matrix",
+                    help="Greedy selection backend: full similarity matrix, or a FAISS index (large candidate sets)")
+    ap.add_argument("--max-orig-sim", type=float, default=None,
+                    help="Drop candidates whose counterfactual is more similar than this to its original")
     args = ap.parse_args()
 
+    use_faiss = args.nn_index != "matrix" and args.selection == "greedy"
+    if use_faiss:
+        try:
+            import faiss  # noqa: F401
+        except ImportError:
+            print("faiss not installed, using the similarity matrix")
+            use_faiss = False
+
     # Load all candidates (use latest by default)
     candidates_path = f"reports/demos/all_candidates_{args.task}_latest.json"
     if not Path(candidates_path).exists():
@@ -38,37 +151,61 @@ def main():
             print(f"Error: No candidate files found. Run make_demos first.")
             return
 
-    candidates = json.loads(Path(candidates_path).read_text())
+    candidates_path = resolve_latest(candidates_path)
+    candidates = load_json_fast(candidates_path)
     print(f"Loaded {len(candidates)} candidates from {candidates_path}")
 
+    # Greedy selection only thresholds similarities, so int8 products stay in the integer
+    # domain and the threshold is scaled instead of dividing the whole matrix
+    int_sims = args.embed_dtype == "int8" and args.selection == "greedy"
+    sim_scale = INT8_SCALE * INT8_SCALE if int_sims else 1
+
     # Apply diversity filter and select top-K
+    # Only the embedder (import, model load, encode) may be unavailable; errors past it propagate
     try:
-        from sentence_transformers import SentenceTransformer
-        embedder = SentenceTransformer("all-MiniLM-L6-v2")
-        vecs = embedder.encode([c["counterfactual"] for c in candidates], normalize_embeddings=True)
-        print("Using sentence transformer for diversity filtering")
+        vecs = encode_cached([c["counterfactual"] for c in candidates])
+        orig_vecs = encode_cached([c["original"] for c in candidates]) if args.max_orig_sim is not None else None
     except Exception:
-        vecs = None
+        vecs, sim = None, None
         print("Sentence transformer not available, skipping diversity filtering")
+    else:
+        if orig_vecs is not None:
+            # One row-wise pass over (counterfactual, original) pairs drops near-copies
+            orig_sims = rowwise_cosine(vecs, orig_vecs)
+            keep = np.flatnonzero(orig_sims <= args.max_orig_sim)
+            print(f"Dropped {len(candidates) - len(keep)} candidates too similar to their original")
+            candidates = [candidates[i] for i in keep]
+            vecs = vecs[keep]
+        # Embeddings are L2-normalized, so one matmul gives every pairwise cosine similarity
+        sim = None if use_faiss else similarity_matrix(vecs, args.embed_dtype, raw_int=int_sims)
+        print("Using sentence transformer for diversity filtering")
 
     selected, selected_idx = [], []
-    order = sorted(range(len(candidates)), key=lambda i: candidates[i]["score"], reverse=True)
-    
-    for i in order:
-        if len(selected) >= args.k:
-            break
+    if args.selection == "mmr" and sim is not None:
+        scores = np.array([c["score"] for c in candidates], dtype=np.float32)
+        selected_idx = mmr_select(scores, sim, args.k, args.diversity_threshold, args.mmr_lambda)
+        selected = [candidates[i] for i in selected_idx]
+    elif use_faiss and vecs is not None:
+        order = sorted(range(len(candidates)), key=lambda i: candidates[i]["score"], reverse=True)
+        selected_idx = greedy_select_faiss(vecs, order, args.k, args.diversity_threshold, hnsw=args.nn_index == "faiss-hnsw")
+        selected = [candidates[i] for i in selected_idx]
+    else:
+        order = sorted(range(len(candidates)), key=lambda i: candidates[i]["score"], reverse=True)
+        # running_max[j] = highest similarity of candidate j to any pick so far
+        running_max = np.full(len(candidates), -sim_scale, dtype=sim.dtype if sim is not None else np.float32)
+        threshold = args.diversity_threshold * sim_scale
         
-        if vecs is not None:
-            keep = True
-            for jdx in selected_idx:
-                if cosine(vecs[i], vecs[jdx]) > args.diversity_threshold:
-                    keep = False
-                    break
-            if not keep: 
+        for i in order:
+            if len(selected) >= args.k:
+                break
+            
+            if running_max[i] > threshold:
                 continue
-        
-        selected.append(candidates[i])
-        selected_idx.append(i)
+            
+            selected.append(candidates[i])
+            selected_idx.append(i)
+            if sim is not None:
+                np.maximum(running_max, sim[i], out=running_max)
 
     # Save selected demos with timestamp
     import datetime
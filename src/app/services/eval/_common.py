@@ -0,0 +1,155 @@
+"""
+Prompt building, batched inference and metrics shared by the eval entrypoints.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+from jinja2 import Template
+from sklearn.metrics import f1_score
+from tqdm import tqdm
+
+from ...utils.json_fast import extract_json, loads
+
+EVAL_TEMPLATE = "prompts/annotation/annotator_with_demos.txt"
+RESPONSE_CACHE_PATH = Path("reports/cache/ann_cache.json")
+
+class ResponseCache:
+    """Raw completions keyed by a blake2b hash of the request, persisted as one JSON file
+
+    Rerunning an eval (same candidates, config and test set) sends the same prompts again;
+    those are answered without a request.
+    The key covers the backend, host, model, temperature and token budget as well as the
+    prompt, so changing any of them misses instead of returning stale completions. Opt-in via
+    cfg["eval_cache"] (see eval_cache_from_cfg).
+    """
+
+    def __init__(self, path: str | Path = RESPONSE_CACHE_PATH):
+        self.path = Path(path)
+        try:
+            self.entries = loads(self.path.read_bytes())
+        except (OSError, ValueError):
+            self.entries = {}
+        self.dirty = False
+
+    @staticmethod
+    def key(client, max_tokens: int, prompt: str) -> str:
+        parts = (type(client).__name__, getattr(client, "host", ""), client.model,
+                 getattr(client, "temperature", ""), max_tokens, prompt)
+        return hashlib.blake2b("\x00".join(map(str, parts)).encode("utf-8"), digest_size=16).hexdigest()
+
+    def get(self, key: str):
+        return self.entries.get(key)
+
+    def set(self, key: str, value: str) -> None:
+        self.entries[key] = value
+        self.dirty = True
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temp file and rename so an interrupted run never leaves a truncated cache
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.entries, ensure_ascii=False))
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+def eval_cache_from_cfg(cfg):
+    """The persistent response cache when cfg["eval_cache"] is set (off by default), else None"""
+    return ResponseCache() if cfg.get("eval_cache", False) else None
+
+def build_demo_block(demos):
+    """The few-shot block for a demo set; built once per k, not per test text"""
+    return "\n\n".join(f'Text: {d["counterfactual"]}\nLabel: {d["counterfactual_label"]}' for d in demos)
+
+def render_prompt(tpl: Template, labels, demo_block: str, text):
+    # tpl and demo_block are built once per evaluation; only the test text changes per call
+    return tpl.render(labels=labels, demo_block=demo_block, text=text)
+
+# Stands in for the test text when splitting the rendered prompt into shared prefix and suffix
+_TEXT_SLOT = "\x00TEXT\x00"
+
+def prompt_skeleton(tpl: Template, labels, demo_block: str):
+    """The prompt rendered once with a placeholder text, split around it
+
+    str(text).join(skeleton) equals render_prompt(tpl, labels, demo_block, text), so each test
+    text costs a string join instead of a template render. For the annotation template the
+    skeleton is [prefix, suffix].
+    """
+    return render_prompt(tpl, labels, demo_block, _TEXT_SLOT).split(_TEXT_SLOT)
+
+def eval_batch_size(cfg) -> int:
+    """Test prompts kept in flight at once: cfg["ann_batch"], else cfg["ollama_parallel"]"""
+    return max(1, int(cfg.get("ann_batch", cfg.get("ollama_parallel", 8))))
+
+async def _arun_all(client, prompts, max_tokens: int, parallel: int, desc: str | None = None):
+    """client.arun over every prompt, at most `parallel` requests in flight; results keep prompt order
+
+    Progress is a tqdm bar ticked as each request completes (hidden when stderr is not a terminal).
+    """
+    semaphore = asyncio.Semaphore(parallel)
+
+    with tqdm(total=len(prompts), desc=desc, leave=False, disable=None) as bar:
+        async def run_one(prompt):
+            async with semaphore:
+                out = await client.arun(prompt, system=None, max_tokens=max_tokens, retries=1)
+            bar.update()
+            return out
+
+        return await asyncio.gather(*[run_one(prompt) for prompt in prompts])
+
+def run_prompts(client, tpl: Template, labels, demo_block: str, texts, max_tokens: int, parallel: int = 8,
+                cache: ResponseCache | None = None, desc: str | None = None):
+    """Completions for every test text (any indexable sequence, e.g. a column array), in order
+
+    Clients that accept token ids (vLLM) get the prompt split around the text, so the shared
+    labels + demo prefix is tokenized once instead of once per text. Other backends get
+    `parallel` concurrent requests (match OLLAMA_NUM_PARALLEL on the server). With a cache,
+    only prompts it has not seen for this model are sent.
+    """
+    skeleton = prompt_skeleton(tpl, labels, demo_block)
+    outs = [None] * len(texts)
+    keys = None
+    if cache is not None:
+        keys = [cache.key(client, max_tokens, str(text).join(skeleton)) for text in texts]
+        outs = [cache.get(key) for key in keys]
+    todo = [i for i, out in enumerate(outs) if out is None]
+    if not todo:
+        return outs
+
+    if hasattr(client, "run_batch_prefixed") and len(skeleton) == 2:
+        prefix, suffix = skeleton
+        fresh = client.run_batch_prefixed(prefix, [str(texts[i]) for i in todo], suffix, max_tokens=max_tokens, retries=1)
+    else:
+        prompts = [str(texts[i]).join(skeleton) for i in todo]
+        fresh = asyncio.run(_arun_all(client, prompts, max_tokens, max(1, parallel), desc))
+
+    for i, out in zip(todo, fresh):
+        outs[i] = out
+        if cache is not None:
+            cache.set(keys[i], out)
+    return outs
+
+def _extract_label(out, default):
+    """The "label" of the first JSON object in a completion, or default
+
+    One brace scan that skips braces inside strings, then an orjson parse of just that span.
+    """
+    obj = extract_json(out) if out else None
+    label = obj.get("label") if isinstance(obj, dict) else None
+    return label if isinstance(label, str) else default
+
+def compute_metrics(y_true, y_pred, labels):
+    # Convert once; both metrics read the same arrays
+    yt = np.asarray(y_true)
+    yp = np.asarray(y_pred)
+    return {
+        "accuracy": float((yt == yp).mean()) if len(yt) else 0.0,
+        "macro_f1": float(f1_score(yt, yp, average="macro", labels=labels)),
+        "n": len(yt),
+    }
@@ -1,28 +1,11 @@
-import argparse, json
+import argparse
 from pathlib import Path
 import yaml, pandas as pd
-from jinja2 import Template
-from ...utils.io import load_task_cfg, load_yaml, write_json
-from ...llm.ollama import OllamaClient
-from ...utils.io import load_yaml
-from ...utils.io import load_task_cfg
-from ...utils.io import write_json
-
-def make_prompt(tpl_path: str, labels, demos, text):
-    demo_lines = []
-    for d in demos:
-        demo_lines.append(f'Text: {d["counterfactual"]}\nLabel: {d["counterfactual_label"]}')
-    demo_block = "\n\n".join(demo_lines)
-    tpl = Template(Path(tpl_path).read_text())
-    return tpl.render(labels=labels, demo_block=demo_block, text=text)
-
-def compute_metrics(y_true, y_pred, labels):
-    from sklearn.metrics import accuracy_score, f1_score
-    return {
-        "accuracy": float(accuracy_score(y_true, y_pred)),
-        "macro_f1": float(f1_score(y_true, y_pred, average="macro", labels=labels)),
-        "n": len(y_true),
-    }
+from ...utils.io import load_json_fast, load_task_cfg, load_yaml, resolve_latest, write_json
+from ...utils.jinja_env import ENV
+from ...llm.factory import make_client
+from ._common import (EVAL_TEMPLATE, _extract_label, build_demo_block, compute_metrics, eval_batch_size,
+                      eval_cache_from_cfg, run_prompts)
 
 def main():
     ap = argparse.ArgumentParser()
@@ -52,32 +35,30 @@ def main():
             demos_path = f"reports/demos/{args.demos}"
         demo_file_id = Path(args.demos).stem  # Extract filename without extension
     else:
-        # Use latest demos file (symlink to most recent run) 
-        demos_path = f"reports/demos/demos_{args.task}_latest.json"
+        # Use latest demos file (pointer or symlink to most recent run)
+        demos_path = resolve_latest(f"reports/demos/demos_{args.task}_latest.json")
         # Resolve symlink to get actual filename for report naming
         resolved_path = Path(demos_path).resolve()
         demo_file_id = resolved_path.stem
     
-    demos = json.loads(Path(demos_path).read_text())
+    demos = load_json_fast(demos_path)
 
-    tpl = "prompts/annotation/annotator_with_demos.txt"
-    client = OllamaClient(cfg["model_ann"], temperature=0.2)
+    tpl = ENV.get_template(EVAL_TEMPLATE)
+    demo_block = build_demo_block(demos)
+    client = make_client(cfg, cfg["model_ann"], temperature=0.2)
+    cache = eval_cache_from_cfg(cfg)
 
-    preds = []
-    for text in test_df[text_field].tolist():
-        prompt = make_prompt(tpl, labels, demos, text)
-        out = client.run(prompt, system=None, max_tokens=cfg["ann_max_new"], retries=1)
-        i, j = out.find("{"), out.rfind("}")
-        if i != -1 and j != -1 and j > i:
-            try:
-                obj = json.loads(out[i:j+1])
-                preds.append(obj.get("label", labels[0]))
-            except Exception:
-                preds.append(labels[0])
-        else:
-            preds.append(labels[0])
+    try:
+        outs = run_prompts(client, tpl, labels, demo_block, test_df[text_field].to_numpy(copy=False), cfg["ann_max_new"],
+                           parallel=eval_batch_size(cfg), cache=cache, desc="test")
+    finally:
+        client.close()
+        if cache is not None:
+            cache.save()
+
+    preds = [_extract_label(out, labels[0]) for out in outs]
 
-    m = compute_metrics(test_df[label_field].tolist(), preds, labels)
+    m = compute_metrics(test_df[label_field].to_numpy(copy=False), preds, labels)
     
     # Create descriptive filename with task, model, and demo info
     import datetime
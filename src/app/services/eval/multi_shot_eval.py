@@ -1,45 +1,56 @@
-import argparse, json
-from pathlib import Path
-import yaml, pandas as pd
-from jinja2 import Template
-import random
-from collections import defaultdict
-from ...utils.io import load_task_cfg, load_yaml, write_json
-from ...llm.ollama import OllamaClient
-
-def make_prompt(tpl_path: str, labels, demos, text):
-    demo_lines = []
-    for d in demos:
-        demo_lines.append(f'Text: {d["counterfactual"]}\nLabel: {d["counterfactual_label"]}')
-    demo_block = "\n\n".join(demo_lines)
-    tpl = Template(Path(tpl_path).read_text())
-    return tpl.render(labels=labels, demo_block=demo_block, text=text)
-
-def compute_metrics(y_true, y_pred, labels):
-    from sklearn.metrics import accuracy_score, f1_score
-    return {
-        "accuracy": float(accuracy_score(y_true, y_pred)),
-        "macro_f1": float(f1_score(y_true, y_pred, average="macro", labels=labels)),
-        "n": len(y_true),
-    }
+import argparse
+import pandas as pd
+import heapq, random
+from collections import Counter
+from ...utils.io import load_json_records, load_task_cfg, load_yaml, resolve_latest, write_json
+from ...utils.jinja_env import ENV
+from ...llm.factory import make_client
+from ._common import (EVAL_TEMPLATE, _extract_label, build_demo_block, compute_metrics, eval_batch_size,
+                      eval_cache_from_cfg, run_prompts)
+
+CANDIDATE_FIELDS = ("counterfactual", "counterfactual_label", "score")
+
+def scores_all_equal(candidates):
+    """True when every candidate has the same score (rounded to 6 places against float noise)"""
+    return len({round(c.get("score", 0.0), 6) for c in candidates}) <= 1
+
+def group_by_label(candidates):
+    """label -> positions (int array) of the candidates with that counterfactual_label
+
+    One pandas groupby over the label column; labels keep first-seen order.
+    """
+    if not candidates:
+        return {}
+    labels_df = pd.DataFrame(candidates, columns=["counterfactual_label"])
+    return labels_df.groupby("counterfactual_label", sort=False).indices
+
+def select_random_balanced_demos(all_candidates, k, rng=None, all_equal=None, label_groups=None, file_order=None):
+    """Select k demos with random sampling and label balance when all scores are equal
 
-def select_random_balanced_demos(all_candidates, k):
-    """Select k demos with random sampling and label balance when all scores are equal"""
-    
+    all_candidates must already be sorted by score, highest first (main sorts once for every k).
+    When k covers every candidate they are all used in file order (file_order, the unsorted list,
+    if given), as before the sweep sorted once.
+    rng is a random.Random; the global random state is never touched. all_equal and
+    label_groups (group_by_label of all_candidates) are computed by main once for the sweep;
+    they are only derived here when the caller leaves them out.
+    """
+    rng = rng or random.Random(42)
+
+    # Compared against the full list: main may pass the ranking cut to the largest k
+    if file_order is not None and len(file_order) <= k:
+        return file_order
     if len(all_candidates) <= k:
         return all_candidates
-    
-    # Check if all candidates have the same score (within small tolerance)
-    scores = [c.get("score", 0.0) for c in all_candidates]
-    unique_scores = set(round(score, 6) for score in scores)  # Round to avoid floating point issues
-    
-    if len(unique_scores) <= 1:
-        print(f"    All candidates have same score ({scores[0]:.3f}), using random balanced selection")
+
+    if all_equal is None:
+        all_equal = scores_all_equal(all_candidates)
+
+    if all_equal:
+        print(f"    All candidates have same score ({all_candidates[0].get('score', 0.0):.3f}), using random balanced selection")
         
         # Group by label for balanced selection
-        label_groups = defaultdict(list)
-        for candidate in all_candidates:
-            label_groups[candidate['counterfactual_label']].append(candidate)
+        if label_groups is None:
+            label_groups = group_by_label(all_candidates)
         
         # Calculate how many per label
         num_labels = len(label_groups)
@@ -48,73 +59,64 @@ def select_random_balanced_demos(all_candidates, k):
         
         selected = []
         labels = list(label_groups.keys())
-        random.shuffle(labels)  # Randomize label order
+        rng.shuffle(labels)  # Randomize label order
         
         for i, label in enumerate(labels):
             # Add extra one for first few labels if there's remainder
             count = per_label + (1 if i < remainder else 0)
             
-            if len(label_groups[label]) <= count:
-                # Take all candidates for this label
-                selected.extend(label_groups[label])
-            else:
-                # Randomly sample from this label
-                selected.extend(random.sample(label_groups[label], count))
+            positions = label_groups[label]
+            if len(positions) > count:
+                # Randomly sample from this label; drawing positions consumes the same
+                # random.Random stream as sampling the candidates themselves
+                positions = rng.sample(positions.tolist(), count)
+            selected.extend(all_candidates[j] for j in positions)
         
         # Shuffle final selection
-        random.shuffle(selected)
+        rng.shuffle(selected)
         return selected[:k]
-    
+
     else:
-        print(f"    Found {len(unique_scores)} different scores, using score-based selection")
-        # Use original score-based selection
-        sorted_candidates = sorted(all_candidates, key=lambda x: x.get("score", 0.0), reverse=True)
-        return sorted_candidates[:k]
+        print("    Candidate scores differ, using score-based selection")
+        # Score-based selection: the input is already in score order
+        return all_candidates[:k]
+
+def evaluate_with_k_demos(cfg, task_cfg, test_df, sorted_candidates, k, text_field, label_field, client, tpl,
+                          cache=None, all_equal=None, label_groups=None, file_order=None):
+    """Evaluate with top-k demos (using random balanced selection if scores are equal)
 
-def evaluate_with_k_demos(cfg, task_cfg, test_df, all_candidates, k, text_field, label_field):
-    """Evaluate with top-k demos (using random balanced selection if scores are equal)"""
+    client and the compiled prompt template tpl are shared by every k of the sweep (one
+    connection pool, model kept loaded, template compiled once), as is the response cache.
+    """
     labels = task_cfg["labels"]
-    
-    # Set random seed for reproducible results
-    random.seed(42)
-    
+
+    # Fixed seed per k for reproducible results, local so other users of random are unaffected
+    rng = random.Random(42)
+
     # Select k demos using appropriate strategy
-    selected_demos = select_random_balanced_demos(all_candidates, k)
-    
+    selected_demos = select_random_balanced_demos(sorted_candidates, k, rng, all_equal, label_groups, file_order)
+
     if len(selected_demos) < k:
         print(f"    Warning: Only {len(selected_demos)} demos available, requested {k}")
-    
+
     # Show label distribution
-    label_counts = defaultdict(int)
-    for demo in selected_demos:
-        label_counts[demo['counterfactual_label']] += 1
-    
+    label_counts = Counter(demo['counterfactual_label'] for demo in selected_demos)
+
     print(f"    Selected {len(selected_demos)} demos with distribution: {dict(label_counts)}")
-    
-    tpl = "prompts/annotation/annotator_with_demos.txt"
-    client = OllamaClient(cfg["model_ann"], temperature=0.2)
 
-    preds = []
-    test_texts = test_df[text_field].tolist()
+    demo_block = build_demo_block(selected_demos)
+
+    # Object-dtype column view, no per-k list copy
+    test_texts = test_df[text_field].to_numpy(copy=False)
     print(f"    Evaluating {len(test_texts)} test examples...")
-    
-    for i, text in enumerate(test_texts):
-        if (i + 1) % 10 == 0 or i < 5:  # Show progress every 10 examples
-            print(f"      Progress: {i+1}/{len(test_texts)} examples")
-        
-        prompt = make_prompt(tpl, labels, selected_demos, text)
-        out = client.run(prompt, system=None, max_tokens=cfg["ann_max_new"], retries=1)
-        i, j = out.find("{"), out.rfind("}")
-        if i != -1 and j != -1 and j > i:
-            try:
-                obj = json.loads(out[i:j+1])
-                preds.append(obj.get("label", labels[0]))
-            except Exception:
-                preds.append(labels[0])
-        else:
-            preds.append(labels[0])
 
-    return compute_metrics(test_df[label_field].tolist(), preds, labels)
+    # All test prompts go out together (concurrent requests sharing the demo prefix)
+    outs = run_prompts(client, tpl, labels, demo_block, test_texts, cfg["ann_max_new"],
+                       parallel=eval_batch_size(cfg), cache=cache, desc=f"k={k}")
+
+    preds = [_extract_label(out, labels[0]) for out in outs]
+
+    return compute_metrics(test_df[label_field].to_numpy(copy=False), preds, labels)
 
 def main():
     ap = argparse.ArgumentParser()
@@ -125,7 +127,6 @@ def main():
 
     cfg = load_yaml(args.config)
     task_cfg = load_task_cfg(args.task)
-    labels = task_cfg["labels"]
     test_df = pd.read_csv(task_cfg["split"]["test"])
 
     # Get field mappings
@@ -140,54 +141,75 @@ def main():
         else:
             candidates_path = f"reports/demos/{args.candidates}"
     else:
-        # Use latest candidates file (symlink to most recent run) 
-        candidates_path = f"reports/demos/all_candidates_{args.task}_latest.json"
-    
-    all_candidates = json.loads(Path(candidates_path).read_text())
-    
+        # Use latest candidates file (pointer to most recent run)
+        candidates_path = resolve_latest(f"reports/demos/all_candidates_{args.task}_latest.json")
+
+    # Only the fields the sweep reads; the full candidate records (filter details etc.) are dropped
+    all_candidates = load_json_records(candidates_path, CANDIDATE_FIELDS)
+
     # Original few-shot counts we want to test
     target_few_shot_counts = [10, 15, 30, 50, 70, 90, 120]
-    
+
     # Dynamic few-shot counts based on available candidates
     max_available = len(all_candidates)
     few_shot_counts = []
-    
+
     # Add all target counts that are <= available candidates
     for k in target_few_shot_counts:
         if k <= max_available:
             few_shot_counts.append(k)
-    
+
     # Add the maximum available count if it's not already in the list
     if max_available not in few_shot_counts and max_available > 0:
         few_shot_counts.append(max_available)
-    
+
     # Sort to maintain order
     few_shot_counts.sort()
-    
+
     print(f"Loaded {len(all_candidates)} candidates from: {candidates_path}")
     print(f"Target few-shot counts: {target_few_shot_counts}")
     print(f"Actual few-shot counts: {few_shot_counts}")
     print(f"Using model: {cfg['model_ann']}")
     print(f"Test dataset size: {len(test_df)} examples")
-    
-    # Check if all candidates have same score
-    scores = [c.get("score", 0.0) for c in all_candidates]
-    unique_scores = set(round(score, 6) for score in scores)
-    if len(unique_scores) <= 1:
-        print(f"📊 All candidates have identical scores ({scores[0]:.6f}) - using random balanced selection")
+
+    # Check once whether all candidates have the same score; every k reuses the answer
+    unique_scores = {round(c.get("score", 0.0), 6) for c in all_candidates}
+    all_equal = len(unique_scores) <= 1
+    if all_equal:
+        print(f"📊 All candidates have identical scores ({next(iter(unique_scores), 0.0):.6f}) - using random balanced selection")
     else:
         print(f"📊 Found {len(unique_scores)} different score levels - using score-based selection")
-    
+
+    # Ranked once for the whole k-sweep, and only as deep as the largest k. With identical scores
+    # the order carries no information, so file order is kept without sorting.
+    if all_equal:
+        sorted_candidates = all_candidates
+        # Only the tied-score selector uses the groups; built once instead of per k
+        label_groups = group_by_label(sorted_candidates)
+    else:
+        sorted_candidates = heapq.nlargest(max(few_shot_counts, default=0), all_candidates,
+                                           key=lambda x: x.get("score", 0.0))
+        label_groups = None
+
     results = {}
-    
+    client = make_client(cfg, cfg["model_ann"], temperature=0.2)
+    tpl = ENV.get_template(EVAL_TEMPLATE)
+    cache = eval_cache_from_cfg(cfg)
+
     print(f"\nEvaluating {args.task.upper()} with different few-shot counts...")
     print("=" * 60)
-    
-    for k in few_shot_counts:
-        print(f"\nEvaluating with {k} few-shot examples...")
-        metrics = evaluate_with_k_demos(cfg, task_cfg, test_df, all_candidates, k, text_field, label_field)
-        results[k] = metrics
-        print(f"  Accuracy: {metrics['accuracy']:.3f}, Macro-F1: {metrics['macro_f1']:.3f}")
+
+    try:
+        for k in few_shot_counts:
+            print(f"\nEvaluating with {k} few-shot examples...")
+            metrics = evaluate_with_k_demos(cfg, task_cfg, test_df, sorted_candidates, k, text_field, label_field, client, tpl, cache,
+                                            all_equal=all_equal, label_groups=label_groups, file_order=all_candidates)
+            results[k] = metrics
+            print(f"  Accuracy: {metrics['accuracy']:.3f}, Macro-F1: {metrics['macro_f1']:.3f}")
+    finally:
+        client.close()
+        if cache is not None:
+            cache.save()
 
     # Print results table
     print("\n" + "="*80)
@@ -198,12 +220,12 @@ def main():
         print(f"{k:>8}", end="")
     print()
     print("-" * 80)
-    
+
     print("Counterfactuals ", end="")
     for k in few_shot_counts:
         print(f"{results[k]['macro_f1']:.2f}    ", end="")
     print()
-    
+
     print("\nACCURACY SCORES")
     print("-" * 80)
     print("Counterfactuals ", end="")
@@ -215,9 +237,9 @@ def main():
     import datetime
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     model_name = cfg["model_ann"].replace(":", "_").replace("/", "_")
-    
+
     filename = f"multi_shot_eval_{args.task}_{model_name}_{timestamp}.json"
-    
+
     detailed_results = {
         "task": args.task,
         "model": cfg["model_ann"],
@@ -227,9 +249,9 @@ def main():
         "actual_few_shot_counts": few_shot_counts,
         "few_shot_results": results,
         "eval_timestamp": timestamp,
-        "selection_method": "random_balanced" if len(unique_scores) <= 1 else "score_based"
+        "selection_method": "random_balanced" if all_equal else "score_based"
     }
-    
+
     write_json(f"reports/runs/{filename}", detailed_results)
     print(f"\nDetailed results saved to reports/runs/{filename}")
 
@@ -0,0 +1,36 @@
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+
+
+def hash_key(*parts) -> str:
+    """Stable md5 key for a tuple of strings"""
+    return hashlib.md5("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+class DiskCache:
+    """Persistent key -> JSON value store, one file per key under `directory`"""
+
+    def __init__(self, directory: str | Path):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def get(self, key: str):
+        try:
+            return json.loads(self._path(key).read_text())
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key: str, value) -> None:
+        # Write to a temp file and rename so concurrent readers never see a partial entry
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp, self._path(key))
+
+    def __contains__(self, key: str) -> bool:
+        return self._path(key).exists()
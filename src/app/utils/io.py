@@ -1,20 +1,96 @@
 from pathlib import Path
-import yaml, json, pandas as pd
+from functools import lru_cache
+import copy, os, yaml, json, pandas as pd
+from .json_fast import dumps_pretty, loads
+from .cache import hash_key
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
 
 TASKS_DIR = Path("configs/tasks")
+SPLIT_CACHE_DIR = Path("cache/splits")
+
+# libyaml's C loader when PyYAML was built with it
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+@lru_cache(maxsize=64)
+def _parse_yaml(path: str, mtime_ns: int):
+    # mtime_ns is part of the key so an edited file is parsed again
+    return yaml.load(Path(path).read_text(), Loader=_YAML_LOADER)
 
 def load_yaml(path: str | Path):
-    return yaml.safe_load(Path(path).read_text())
+    """Parsed YAML file, memoized per path; callers get their own copy and may mutate it"""
+    p = Path(path)
+    return copy.deepcopy(_parse_yaml(str(p.resolve()), p.stat().st_mtime_ns))
 
 def load_task_cfg(task_name: str):
-    return yaml.safe_load((TASKS_DIR / f"{task_name}.yaml").read_text())
+    return load_yaml(TASKS_DIR / f"{task_name}.yaml")
 
 def load_splits(task_cfg):
     tr = pd.read_csv(task_cfg["split"]["train"])
     te = pd.read_csv(task_cfg["split"]["test"])
     return tr, te
 
+def read_csv_cached(path: str | Path, usecols=None, dtype=None) -> pd.DataFrame:
+    """pd.read_csv through a parquet snapshot in cache/splits, reused while it is newer than the CSV
+
+    Without a parquet engine (pyarrow or fastparquet), or when the snapshot cannot be written
+    (read-only cache dir, column types the engine rejects), this is a plain read_csv.
+    """
+    src = Path(path)
+    snapshot = SPLIT_CACHE_DIR / f"{src.stem}_{hash_key(src.resolve(), usecols, dtype)[:12]}.parquet"
+    if snapshot.exists() and snapshot.stat().st_mtime >= src.stat().st_mtime:
+        return pd.read_parquet(snapshot)
+    df = pd.read_csv(src, usecols=usecols, dtype=dtype)
+    try:
+        SPLIT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        df.to_parquet(snapshot)
+    except (ImportError, OSError, ValueError):
+        # Never leave a partial snapshot that a later call would take as fresh
+        snapshot.unlink(missing_ok=True)
+    return df
+
+def load_json_fast(path: str | Path):
+    """Parse a JSON file from its raw bytes (orjson when installed, no decode-to-str step)"""
+    return loads(Path(path).read_bytes())
+
+def load_json_records(path: str | Path, fields):
+    """The objects of a top-level JSON list, keeping only `fields` (missing ones are left out)
+
+    With ijson installed the file is streamed, so only the projected records are ever held in
+    memory; otherwise it is parsed in one go with load_json_fast.
+    """
+    if ijson is not None:
+        with open(path, "rb") as f:
+            return [{k: o[k] for k in fields if k in o} for o in ijson.items(f, "item", use_float=True)]
+    return [{k: o[k] for k in fields if k in o} for o in load_json_fast(path)]
+
 def write_json(path: str | Path, obj):
     p = Path(path); p.parent.mkdir(parents=True, exist_ok=True)
-    p.write_text(json.dumps(obj, indent=2, ensure_ascii=False))
+    p.write_bytes(dumps_pretty(obj))
     return p
+
+def write_latest_pointer(latest_path: str | Path, target_path: str | Path):
+    """Point a "latest" file at target_path: writes {"path": target_path} and renames it into place
+
+    os.replace is atomic (and works where symlinks do not), so readers never see a missing or
+    partial pointer.
+    """
+    latest = Path(latest_path)
+    tmp = latest.with_name(latest.name + ".tmp")
+    tmp.write_text(json.dumps({"path": str(target_path)}))
+    os.replace(tmp, latest)
+    return latest
+
+def resolve_latest(path: str | Path) -> str:
+    """The file a "latest" pointer names, or path itself for a regular data file (or old symlink)"""
+    with open(path, "rb") as f:
+        head = f.read(1024)
+    # Pointer files are one small JSON object; candidate/demo files are lists
+    if head.lstrip().startswith(b"{"):
+        data = loads(Path(path).read_bytes())
+        if isinstance(data, dict) and "path" in data:
+            return data["path"]
+    return str(path)
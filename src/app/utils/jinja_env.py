@@ -0,0 +1,21 @@
+from pathlib import Path
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+# Template paths are repo-relative (e.g. "prompts/annotation/annotator.txt"), like the rest of the pipeline
+BYTECODE_CACHE_DIR = Path(".jinja_cache")
+
+class _LazyBytecodeCache(FileSystemBytecodeCache):
+    """Bytecode cache that creates its directory on the first write, not at import"""
+
+    def dump_bytecode(self, bucket):
+        Path(self.directory).mkdir(exist_ok=True)
+        super().dump_bytecode(bucket)
+
+# Shared environment: each template is parsed/compiled once per process (and once per
+# source change on disk via the bytecode cache), then only rendered per call
+ENV = Environment(
+    loader=FileSystemLoader("."),
+    bytecode_cache=_LazyBytecodeCache(str(BYTECODE_CACHE_DIR)),
+    auto_reload=False,
+)
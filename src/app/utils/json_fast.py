@@ -0,0 +1,132 @@
+"""
+Fast extraction of the first JSON object from an LLM response.
+
+Works on bytes: strips a ```json fence, finds the first balanced {...} with a brace
+scanner that respects string literals, and parses the slice with orjson (stdlib json
+when orjson is not installed).
+"""
+
+import json
+import re
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    orjson = None
+    _loads = json.loads
+
+# Only these bytes change the scanner state; everything else is skipped by the regex engine
+_STRUCTURAL_RE = re.compile(rb'[{}"\\]')
+_FENCE = b"```json"
+
+
+def loads(data: str | bytes):
+    """Parse a complete JSON document (orjson when installed)"""
+    return _loads(data)
+
+
+def dumps_pretty(obj) -> bytes:
+    """obj as 2-space indented UTF-8 JSON (orjson when installed: int keys and numpy values allowed)"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, indent=2, ensure_ascii=False).encode("utf-8")
+
+
+def _strip_fence(buf: bytes) -> bytes:
+    """Body of a ```json fenced block if present"""
+    _, fence, tail = buf.partition(_FENCE)
+    if fence:
+        body, closed, _ = tail.partition(b"```")
+        if closed:
+            return body.strip()
+    return buf
+
+
+def find_json_object(buf: bytes):
+    """(start, end) of the first balanced {...} in buf, ignoring braces inside strings"""
+    start = buf.find(b"{")
+    if start == -1:
+        return None
+
+    depth = 0
+    in_string = False
+    skip_to = -1
+    for m in _STRUCTURAL_RE.finditer(buf, start):
+        pos = m.start()
+        if pos < skip_to:
+            continue
+        ch = buf[pos]
+        if ch == 0x5C:  # backslash: the next byte is escaped
+            if in_string:
+                skip_to = pos + 2
+        elif ch == 0x22:  # quote
+            in_string = not in_string
+        elif in_string:
+            continue
+        elif ch == 0x7B:  # {
+            depth += 1
+        else:  # }
+            depth -= 1
+            if depth == 0:
+                return start, pos + 1
+
+    # Unbalanced (e.g. output cut off at max_tokens): fall back to the outermost braces
+    end = buf.rfind(b"}")
+    return (start, end + 1) if end > start else None
+
+
+def _span(raw):
+    buf = raw.encode("utf-8") if isinstance(raw, str) else bytes(raw)
+    buf = _strip_fence(buf)
+    return buf, find_json_object(buf)
+
+
+def extract_json_strict(raw: str | bytes):
+    """Parse the first JSON object in raw
+
+    Raises ValueError if there is no object and json.JSONDecodeError if it is malformed.
+    """
+    buf, span = _span(raw)
+    if span is None:
+        raise ValueError("No JSON in LLM output")
+    view = memoryview(buf)[span[0]:span[1]]
+    return _loads(view if orjson is not None else bytes(view))
+
+
+def extract_json(raw: str | bytes):
+    """Parse the first JSON object in raw, or None if there is none or it is malformed"""
+    try:
+        return extract_json_strict(raw)
+    except ValueError:
+        return None
+
+
+def json_text(raw: str | bytes):
+    """The JSON object text extract_json would parse (for repair fallbacks), or None"""
+    buf, span = _span(raw)
+    if span is None:
+        return None
+    return buf[span[0]:span[1]].decode("utf-8", errors="replace")
+
+
+_VALID_ESCAPES = frozenset('"\\/bfnrtu')
+
+
+def sanitize_json_escapes(s: str) -> str:
+    """Double every backslash that does not start a valid JSON escape, in one linear pass"""
+    parts = []
+    start = 0
+    i = s.find("\\")
+    while i != -1:
+        nxt = s[i + 1:i + 2]
+        if nxt and nxt in _VALID_ESCAPES:
+            # Valid escape: keep both characters and continue after them
+            i = s.find("\\", i + 2)
+            continue
+        parts.append(s[start:i])
+        parts.append("\\\\")
+        start = i + 1
+        i = s.find("\\", start)
+    parts.append(s[start:])
+    return "".join(parts)
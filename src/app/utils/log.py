@@ -1,10 +1,14 @@
 from loguru import logger
-import os
+import os, sys
 
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 
 logger.remove()
-logger.add(lambda msg: print(msg, end=""), level=LOG_LEVEL)
+# Default sink is synchronous, so log lines stay in order with print() output elsewhere
+logger.add(sys.stdout, level=LOG_LEVEL, filter=lambda record: not record["extra"].get("queued"))
+# Queued sink for the concurrent demo rows (get_logger(queued=True)): records are written by a
+# background thread so rows never block on terminal I/O. Drain it with logger.complete()
+logger.add(sys.stdout, level=LOG_LEVEL, enqueue=True, filter=lambda record: record["extra"].get("queued", False))
 
-def get_logger():
-    return logger
+def get_logger(queued: bool = False):
+    return logger.bind(queued=True) if queued else logger
@@ -0,0 +1,14 @@
+from src.app.services.eval._common import EVAL_TEMPLATE, build_demo_block, prompt_skeleton, render_prompt
+from src.app.utils.jinja_env import ENV
+
+
+def test_prompt_skeleton_matches_full_render():
+    tpl = ENV.get_template(EVAL_TEMPLATE)
+    labels = ["joy", "anger"]
+    demo_block = build_demo_block([{"counterfactual": "i feel {{ great }}", "counterfactual_label": "joy"}])
+
+    skeleton = prompt_skeleton(tpl, labels, demo_block)
+
+    assert len(skeleton) == 2
+    for text in ["i feel calm today", "", "braces {{ text }} and \\ slashes\n", 3.5]:
+        assert str(text).join(skeleton) == render_prompt(tpl, labels, demo_block, text)
@@ -0,0 +1,33 @@
+import json
+
+import pytest
+
+from src.app.utils.json_fast import extract_json, extract_json_strict, json_text, sanitize_json_escapes
+
+
+def test_extract_json_stops_at_first_balanced_object():
+    out = 'Sure! {"label": "joy", "note": "a } inside {a string}"} trailing } text'
+    assert extract_json(out) == {"label": "joy", "note": "a } inside {a string}"}
+
+
+def test_extract_json_handles_fence_escapes_and_bytes():
+    out = 'Here:\n```json\n{"text": "say \\"hi\\" {now}", "n": [1, 2]}\n```\nDone {x}'
+    assert extract_json(out) == {"text": 'say "hi" {now}', "n": [1, 2]}
+    assert extract_json(out.encode()) == extract_json(out)
+
+
+def test_extract_json_errors():
+    with pytest.raises(ValueError):
+        extract_json_strict("no json here")
+    with pytest.raises(json.JSONDecodeError):
+        extract_json_strict('{"label": joy}')
+    assert extract_json("no json here") is None
+    assert extract_json('{"label": joy}') is None
+    assert json_text('x {"a": 1 ') is None
+    assert json_text('x {"a": {"b": 1} ') == '{"a": {"b": 1}'
+
+
+def test_sanitize_json_escapes_keeps_valid_escapes():
+    raw = r'{"a": "x\y \' \\ \n \u00e9 \""}'
+    assert json.loads(sanitize_json_escapes(raw)) == {"a": "x\\y \\' \\ \n \u00e9 \""}
+    assert sanitize_json_escapes("end\\") == "end\\\\"
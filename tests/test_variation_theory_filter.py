@@ -0,0 +1,214 @@
+import asyncio
+import json
+
+from src.app.filter.variation_theory_filter import VariationTheoryFilter
+
+CFG = {"model_ann": "test-model", "filter_cache": False, "pkr_threshold": 0.1, "lfr_threshold": 0.2, "slfr_threshold": 0.05}
+
+
+class FakeClient:
+    supports_grammar = False
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.prompts = []
+
+    def run(self, prompt, system=None, max_tokens=64, retries=1, timeout=600, grammar=None):
+        self.prompts.append(prompt)
+        return self.responses.pop(0)
+
+
+def _item(cf, original="i feel calm today", target="anger"):
+    return {"original": original, "counterfactual": cf, "pattern_info": None, "target_label": target}
+
+
+def _scores(**overrides):
+    data = {"pkr_score": 0.9, "lfr_score": 0.8, "slfr_score": 0.7, "minimality": 0.6,
+            "fluency": 0.6, "label_determinism": 0.6, "faithfulness": 0.6}
+    data.update(overrides)
+    return data
+
+
+def test_batch_filter_single_call_and_input_order():
+    vt = VariationTheoryFilter(CFG)
+    vt.client = FakeClient([json.dumps({"results": [
+        dict(_scores(), idx=2),
+        dict(_scores(pkr_score=0.0), idx=1),
+    ]})])
+
+    results = vt.apply_three_stage_filter_batch([
+        _item("i feel angry today"),
+        _item("{broken}"),
+        _item("i feel furious today"),
+    ])
+
+    assert len(vt.client.prompts) == 1
+    assert [r["stage_failed"] for r in results] == ["C2", "C1", "None"]
+    assert results[2]["pass_all"] and results[2]["pkr"] == 0.9
+
+
+def test_batch_filter_retries_missing_indices_as_one_batch():
+    vt = VariationTheoryFilter(CFG)
+    vt.client = FakeClient([
+        json.dumps({"results": [dict(_scores(), idx=2)]}),
+        json.dumps({"results": [dict(_scores(lfr_score=0.0), idx=1)]}),
+        json.dumps(_scores()),
+    ])
+
+    results = vt.apply_three_stage_filter_batch([
+        _item("i feel angry today"), _item("i feel furious today"), _item("i feel mad today"),
+    ])
+
+    # First batch, then one retry batch for items 1 and 3, then a per-item call for item 3
+    assert len(vt.client.prompts) == 3
+    assert "could not be read" in vt.client.prompts[1] and "ITEM 2:" in vt.client.prompts[1]
+    assert [r["stage_failed"] for r in results] == ["C3", "None", "None"]
+
+
+def test_many_filter_keeps_input_order():
+    class AsyncFakeClient(FakeClient):
+        async def arun(self, prompt, system=None, max_tokens=64, retries=1, timeout=600, grammar=None):
+            return self.run(prompt, system, max_tokens, retries, timeout, grammar)
+
+    vt = VariationTheoryFilter(CFG)
+    vt.client = AsyncFakeClient([json.dumps(_scores()), json.dumps(_scores(slfr_score=0.0))])
+
+    results = asyncio.run(vt.apply_three_stage_filter_many([
+        _item("i feel angry today"), _item("..."), _item("i feel furious today"),
+    ]))
+
+    assert [r["stage_failed"] for r in results] == ["None", "C1", "C3"]
+
+
+def test_prefilter_rejects_without_llm_call():
+    vt = VariationTheoryFilter(CFG)
+    vt.client = FakeClient([])
+
+    unchanged = vt.apply_three_stage_filter("i feel calm today", "i feel calm today", None, "anger")
+    rewritten = vt.apply_three_stage_filter("i feel calm today", "Zebras gobbled up sixty waffles", None, "anger")
+
+    assert unchanged["stage_failed"] == "C3"
+    assert rewritten["stage_failed"] == "C2"
+    assert vt.client.prompts == []
+
+
+def test_quick_prescreen_matches_local_stages():
+    vt = VariationTheoryFilter(CFG)
+
+    assert vt.quick_prescreen("i feel calm today", "i feel angry today")
+    assert not vt.quick_prescreen("i feel calm today", "i feel calm today")
+    assert not vt.quick_prescreen("i feel calm today", "Zebras gobbled up sixty waffles")
+    assert not vt.quick_prescreen("i feel calm today", "hi")
+
+
+def test_combined_filter_results_are_cached(tmp_path):
+    cfg = dict(CFG, filter_cache=True, filter_cache_dir=str(tmp_path))
+    vt = VariationTheoryFilter(cfg)
+    vt.client = FakeClient([json.dumps(_scores())])
+
+    first = vt.apply_three_stage_filter("i feel calm today", "i feel angry today", None, "anger")
+    second = VariationTheoryFilter(cfg)
+    second.client = FakeClient([])
+    again = second.apply_three_stage_filter("i feel calm today", "i feel angry today", None, "anger")
+
+    assert again["score"] == first["score"]
+    assert second.client.prompts == []
+
+
+def test_c1_batch_mask_matches_scalar_filter():
+    vt = VariationTheoryFilter(CFG)
+    texts = ["i feel angry today", "hi", 'she said "no', "and then...", "Original: i feel angry",
+             "the the the the cat", "{\"text\": \"x\"}", "i feel 生气 today", ""]
+
+    mask = vt._stage_c1_heuristic_filter_batch(texts)
+
+    assert list(mask) == [vt._stage_c1_heuristic_filter(t)["pass"] for t in texts]
+    assert list(mask) == [True] + [False] * 8
+
+
+def test_batch_filter_deduplicates_identical_candidates():
+    vt = VariationTheoryFilter(CFG)
+    vt.client = FakeClient([json.dumps({"results": [dict(_scores(), idx=1), dict(_scores(), idx=2)]})])
+
+    results = vt.apply_three_stage_filter_batch([
+        _item("i feel angry today"), _item("i feel furious today"), _item("i feel angry today"),
+    ])
+
+    assert "ITEM 2:" in vt.client.prompts[0] and "ITEM 3:" not in vt.client.prompts[0]
+    assert results[0]["score"] == results[2]["score"]
+
+
+def test_combined_prompt_skeleton_matches_full_render():
+    vt = VariationTheoryFilter(CFG)
+    pattern_info = {"strategy": "pattern_guided", "pattern_rule": "swap the emotion word"}
+
+    for original, cf in [("i feel calm today", "i feel angry today"), ("a {{ b }}", "c \\ d")]:
+        expected = vt.combined_template.render(original=original, counterfactual=cf,
+                                               pattern_rule="swap the emotion word", target_label="anger")
+        assert vt._combined_prompt(original, cf, pattern_info, "anger") == expected
+
+
+def test_no_pattern_rule_skips_quality_and_scores_it_as_default():
+    vt = VariationTheoryFilter(CFG)
+    vt.client = FakeClient([json.dumps({"pkr_score": 0.85, "lfr_score": 0.85, "slfr_score": 0.85})])
+
+    result = vt.apply_three_stage_filter("i feel calm today", "i feel angry today", None, "anger")
+
+    assert "minimality" not in vt.client.prompts[0]
+    assert result["details"]["combined"]["quality"] == {}
+    assert abs(result["score"] - (0.85 * 0.85 + 0.15 * 0.5)) < 1e-9
+
+
+def test_batch_filter_splits_pattern_guided_items():
+    vt = VariationTheoryFilter(CFG)
+    guided = {"strategy": "pattern_guided", "pattern_rule": "swap the emotion word"}
+    vt.client = FakeClient([
+        json.dumps({"results": [dict(_scores(), idx=1)]}),
+        json.dumps({"results": [{"idx": 1, "pkr_score": 0.9, "lfr_score": 0.8, "slfr_score": 0.7}]}),
+    ])
+
+    results = vt.apply_three_stage_filter_batch([
+        _item("i feel angry today"), dict(_item("i feel furious today"), pattern_info=guided),
+    ])
+
+    assert len(vt.client.prompts) == 2
+    assert "minimality" in vt.client.prompts[0] and "minimality" not in vt.client.prompts[1]
+    assert results[0]["details"]["combined"]["quality"] == {}
+    assert results[1]["details"]["combined"]["quality"]["minimality"] == 0.6
+
+
+def test_missing_quality_fields_default_when_requested():
+    vt = VariationTheoryFilter(CFG)
+    vt.client = FakeClient([json.dumps({"pkr_score": 0.85, "lfr_score": 0.85, "slfr_score": 0.85})])
+    pattern_info = {"strategy": "pattern_guided", "pattern_rule": "swap the emotion word"}
+
+    result = vt.apply_three_stage_filter("i feel calm today", "i feel angry today", pattern_info, "anger")
+
+    assert result["details"]["combined"]["quality"] == {"minimality": 0.5, "fluency": 0.5,
+                                                        "label_determinism": 0.5, "faithfulness": 0.5}
+
+
+def test_judge_fn_batches_by_default():
+    vt = VariationTheoryFilter(CFG)
+    vt.client = FakeClient([json.dumps({"results": [dict(_scores(), idx=1), dict(_scores(), idx=2)]})])
+
+    results = asyncio.run(vt.judge_fn()([_item("i feel angry today"), _item("i feel furious today")]))
+
+    assert len(vt.client.prompts) == 1
+    assert [r["stage_failed"] for r in results] == ["None", "None"]
+    assert VariationTheoryFilter(dict(CFG, filter_batching=False)).judge_fn().__name__ == "apply_three_stage_filter_many"
+
+
+def test_batch_filter_malformed_entries_fall_back_per_item():
+    vt = VariationTheoryFilter(CFG)
+    vt.client = FakeClient([
+        json.dumps({"results": [["idx", 1], {"idx": 2, "pkr_score": "high"}]}),
+        json.dumps({"results": "none"}),
+        json.dumps(_scores()),
+        json.dumps(_scores()),
+    ])
+
+    results = vt.apply_three_stage_filter_batch([_item("i feel angry today"), _item("i feel furious today")])
+
+    assert len(vt.client.prompts) == 4
+    assert [r["stage_failed"] for r in results] == ["None", "None"]